@@ -0,0 +1,114 @@
+"""
+Load time of compressed resources with utilix.io.read_file, for every
+codec that is installed (gzip, bz2, xz and optionally zstandard, lz4 and
+isal for faster gzip). The time to only decompress the bytes is shown
+separately. The uncompressed baseline is parsed the same way as the
+compressed files (e.g. json with the standard library, not commentjson
+like read_file does for plain .json files), so the difference between the
+rows is the codec.
+
+By default it uses synthetic files shaped like our resources: a float32
+map (.npy), a table (.csv) and a json document. Pass files to compress
+and load those instead:
+
+    python benchmarks/bench_codecs.py --files path/to/map.npy path/to/table.csv
+"""
+import argparse
+import bz2
+import gzip
+import json
+import lzma
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from utilix import io
+
+
+def synthetic_files(folder):
+    x, y = np.meshgrid(np.linspace(0, 10, 2000), np.linspace(0, 10, 2000))
+    smooth_map = (np.sin(x) * np.cos(y) * 100).round(2).astype(np.float32)
+    np.save(os.path.join(folder, 'map.npy'), smooth_map)
+
+    rng = np.random.default_rng(0)
+    table = pd.DataFrame({'number': np.arange(500_000),
+                          'mode': rng.choice(['tpc_bkg', 'tpc_kr83m', 'tpc_ar37'], 500_000),
+                          'livetime': rng.exponential(3600, 500_000).round(1)})
+    table.to_csv(os.path.join(folder, 'table.csv'), index=False)
+
+    doc = {f'run_{i}': {'electron_lifetime': 1e3 + i, 'drift_velocity': 0.675, 'tags': ['good']}
+           for i in range(10_000)}
+    with open(os.path.join(folder, 'doc.json'), 'w') as f:
+        json.dump(doc, f)
+    return [os.path.join(folder, name) for name in ('map.npy', 'table.csv', 'doc.json')]
+
+
+def compressors():
+    result = {'.gz': lambda data: gzip.compress(data, compresslevel=6),
+              '.bz2': bz2.compress,
+              '.xz': lzma.compress}
+    if io.zstandard is not None:
+        # compression (not decompression) can use all cores
+        result['.zst'] = io.zstandard.ZstdCompressor(level=3, threads=-1).compress
+    if io.lz4 is not None:
+        result['.lz4'] = io.lz4.frame.compress
+    return result
+
+
+def timed(func, path, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        func(path)
+    return (time.perf_counter() - start) / number
+
+
+def decompress(path):
+    with io.open_decompressed(path) as f:
+        return f.read()
+
+
+def read_uncompressed(path):
+    """Parse path like read_file parses the content of compressed files"""
+    return io._read_compressed(path, os.path.splitext(path)[1])
+
+
+def report(label, ratio, path, number, load=io.read_file):
+    print(f'  {label:<20} {ratio:>8} {timed(decompress, path, number) * 1e3:12.1f} ms'
+          f' {timed(load, path, number) * 1e3:10.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', nargs='+', help='files to compress and load')
+    parser.add_argument('--number', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        files = args.files or synthetic_files(folder)
+        for path in files:
+            size = os.path.getsize(path)
+            print(f'{os.path.basename(path)} ({size / 1024 ** 2:.1f} MiB)')
+            print(f'  {"":<20} {"ratio":>8} {"decompress":>15} {"load":>13}')
+            report('uncompressed', '', path, args.number, load=read_uncompressed)
+            with open(path, 'rb') as f:
+                content = f.read()
+            for suffix, compress in compressors().items():
+                compressed = os.path.join(folder, os.path.basename(path) + suffix)
+                with open(compressed, 'wb') as f:
+                    f.write(compress(content))
+                ratio = f'{size / os.path.getsize(compressed):.1f}x'
+                report(suffix, ratio, compressed, args.number)
+                if suffix == '.gz' and io.igzip_threaded is not None:
+                    # compare with the standard library
+                    igzip_threaded, io.igzip_threaded = io.igzip_threaded, None
+                    try:
+                        report('.gz (zlib)', ratio, compressed, args.number)
+                    finally:
+                        io.igzip_threaded = igzip_threaded
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Decoding time of API responses: the old path (response.text + json.loads)
+against the json backends of utilix.json_backend on the raw bytes.
+
+By default it runs on synthetic responses shaped like a run document, a
+query page and a get_files listing. Pass a folder with recorded responses
+(one raw response body per file) to use those instead:
+
+    python benchmarks/bench_json.py --responses path/to/recorded/
+"""
+import argparse
+import json
+import os
+import timeit
+
+import requests
+
+from utilix import json_backend
+
+
+def synthetic_responses():
+    data = [{'host': 'rucio-catalogue', 'type': f'type_{i}', 'status': 'transferred',
+             'did': f'xnt_012345:type_{i}-abcdefghij', 'location': 'UC_OSG_USERDISK',
+             'meta': {'size_mb': 1234.5, 'file_count': 42, 'lineage_hash': 'abcdefghij'}}
+            for i in range(500)]
+    doc = {'number': 12345, 'name': '012345', 'source': 'none', 'tags': [], 'data': data}
+    page = [{'number': i, 'name': f'{i:06d}', 'mode': 'tpc_background',
+             'start': '2021-01-01T00:00:00', 'end': '2021-01-01T01:00:00', 'tags': []}
+            for i in range(1000)]
+    files = [{'_id': f'{i:024x}', 'config_name': f'resource_{i}.json', 'length': 12345,
+              'md5': f'{i:032x}', 'uploadDate': '2021-01-01T00:00:00'} for i in range(2000)]
+    return {'run document': json.dumps({'results': doc}).encode(),
+            'query page': json.dumps({'results': page}).encode(),
+            'get_files': json.dumps({'results': files}).encode()}
+
+
+def recorded_responses(folder):
+    responses = {}
+    for name in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, name), 'rb') as f:
+            responses[name] = f.read()
+    return responses
+
+
+def as_response(content):
+    # the API does not send a charset, so response.text has to guess it
+    response = requests.Response()
+    response.status_code = 200
+    response.headers['Content-Type'] = 'application/json'
+    response._content = content
+    return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--responses', help='folder with recorded response bodies')
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    responses = (recorded_responses(args.responses) if args.responses
+                 else synthetic_responses())
+    for label, content in responses.items():
+        print(f'{label} ({len(content) / 1024:.0f} kB)')
+        t = timeit.timeit(lambda: json.loads(as_response(content).text), number=args.number)
+        print(f'  {"json.loads(response.text)":<28} {t / args.number * 1e3:8.3f} ms')
+        for backend in json_backend.BACKENDS:
+            json_backend.set_backend(backend)
+            t = timeit.timeit(lambda: json_backend.loads(as_response(content).content),
+                              number=args.number)
+            print(f'  {backend + " on raw bytes":<28} {t / args.number * 1e3:8.3f} ms')
+        json_backend.set_backend()
+
+
+if __name__ == '__main__':
+    main()
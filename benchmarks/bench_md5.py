@@ -0,0 +1,76 @@
+"""
+md5 hashing of files: the old implementation (4 KiB reads) against
+utilix.hashing with larger buffers, memory mapping, several files in
+parallel and the persistent hash cache.
+
+By default it hashes a few freshly written files of random data, which
+are most likely still in the page cache. Pass existing files to hash
+those instead:
+
+    python benchmarks/bench_md5.py --files /path/to/big/file1 /path/to/big/file2
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+from utilix import hashing
+
+
+def legacy_md5(path):
+    hash_md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            hash_md5.update(chunk)
+    return hash_md5.hexdigest()
+
+
+def timed(label, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    print(f'  {label:<32} {time.perf_counter() - start:8.3f} s')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', nargs='+', help='files to hash')
+    parser.add_argument('--size', type=int, default=256, help='MiB per generated file')
+    parser.add_argument('--n-files', type=int, default=4, help='number of generated files')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        files = args.files
+        if not files:
+            files = []
+            for i in range(args.n_files):
+                path = os.path.join(folder, f'file_{i}')
+                with open(path, 'wb') as f:
+                    for _ in range(args.size):
+                        f.write(os.urandom(1024 ** 2))
+                files.append(path)
+        total = sum(os.path.getsize(path) for path in files)
+        print(f'{len(files)} files, {total / 1024 ** 2:.0f} MiB in total')
+
+        expected = timed('legacy (4 KiB reads)', lambda: [legacy_md5(path) for path in files])
+        for buffer_size in (64 * 1024, 1024 ** 2, 8 * 1024 ** 2):
+            result = timed(f'buffer of {buffer_size // 1024} KiB',
+                           lambda: [hashing.file_md5(path, buffer_size=buffer_size)
+                                    for path in files])
+            assert result == expected
+        result = timed('mmap', lambda: [hashing.file_md5(path, use_mmap=True) for path in files])
+        assert result == expected
+        result = timed(f'{args.workers} files in parallel',
+                       hashing.md5_many, files, max_workers=args.workers, use_cache=False)
+        assert list(result.values()) == expected
+
+        cache = hashing.HashCache(os.path.join(folder, 'md5.sqlite'))
+        timed('hash cache, first time', lambda: [cache.md5(path) for path in files])
+        result = timed('hash cache, unchanged files', lambda: [cache.md5(path) for path in files])
+        assert result == expected
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Per-call latency of the runDB API client with and without a pooled
+session, measured against a local stub server.
+
+    python benchmarks/bench_session.py --calls 500
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from utilix.rundb import make_session
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 is needed for the server to honour keep-alive
+    protocol_version = 'HTTP/1.1'
+    # avoid Nagle + delayed ACK stalls between the header and body writes
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        number = self.path.rstrip('/').split('/')[-1]
+        body = json.dumps({'results': {'number': number, 'data': []}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def time_calls(get, prefix, n_calls):
+    timings = []
+    for i in range(n_calls):
+        t0 = time.perf_counter()
+        response = get(f'{prefix}/runs/number/{i}')
+        response.json()
+        timings.append(time.perf_counter() - t0)
+    timings.sort()
+    return timings
+
+
+def report(label, timings):
+    mean = sum(timings) / len(timings)
+    p50 = timings[len(timings) // 2]
+    p99 = timings[int(len(timings) * 0.99)]
+    print(f'{label:<24} mean {mean * 1e3:7.3f} ms   p50 {p50 * 1e3:7.3f} ms   '
+          f'p99 {p99 * 1e3:7.3f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=500)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    prefix = f'http://127.0.0.1:{server.server_address[1]}'
+
+    try:
+        report('requests.get (before)', time_calls(requests.get, prefix, args.calls))
+        session = make_session(pool_size=10, keep_alive=True)
+        report('pooled session (after)', time_calls(session.get, prefix, args.calls))
+        session.close()
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
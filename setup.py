@@ -20,6 +20,8 @@ setup(
     long_description_content_type='text/markdown',
     packages=find_packages(),
     install_requires=requires,
-    python_requires=">=3.6",
+    extras_require={'async': ['aiohttp'], 'fast': ['orjson'], 'arrow': ['pyarrow'],
+                    'compression': ['zstandard', 'lz4', 'isal']},
+    python_requires=">=3.7",
     long_description=readme + '\n\n' + history,
 )
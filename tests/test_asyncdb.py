@@ -0,0 +1,213 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+try:
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+except ImportError:
+    web = None
+
+from utilix import rundb
+from utilix.retry import RetryPolicy, CircuitBreaker
+
+if web is not None:
+    from utilix import asyncdb
+
+
+class Token:
+    """Stands in for rundb.Token, remembers the thread it was made in"""
+    threads = []
+
+    def __init__(self, path, session=None):
+        self.threads.append(threading.get_ident())
+        self.is_valid = True
+
+    def __call__(self):
+        return 'some_token'
+
+    def new_token(self):
+        self.threads.append(threading.get_ident())
+        self.is_valid = True
+
+
+class StubAPI:
+    """Answers the API calls of AsyncDB for run numbers and pages of runs"""
+
+    def __init__(self, n_pages=3, delay=0):
+        self.n_pages = n_pages
+        self.delay = delay
+        self.pages = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.file = os.urandom(100_000)
+        self.file_md5 = hashlib.md5(self.file).hexdigest()
+        # number of file downloads to answer with a 503
+        self.unavailable = 0
+        self.app = web.Application()
+        self.app.router.add_get('/runs/number/{number}', self.get_doc)
+        self.app.router.add_get('/runs/page/{page}', self.get_page)
+        self.app.router.add_get('/files/{name}/md5', self.get_md5)
+        self.app.router.add_get('/files/{name}', self.get_file)
+
+    async def _answer(self, results, status=200):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        return web.json_response({'results': results}, status=status)
+
+    async def get_doc(self, request):
+        number = int(request.match_info['number'])
+        if number < 0:
+            return await self._answer({}, status=404)
+        return await self._answer({'number': number})
+
+    async def get_page(self, request):
+        page = int(request.match_info['page'])
+        self.pages.append(page)
+        docs = ([{'number': page * 10 + i} for i in range(2)]
+                if page <= self.n_pages else [])
+        return await self._answer(docs)
+
+    async def get_md5(self, request):
+        return await self._answer(self.file_md5)
+
+    async def get_file(self, request):
+        if self.unavailable:
+            self.unavailable -= 1
+            return web.Response(status=503)
+        return web.Response(body=self.file)
+
+
+@unittest.skipIf(web is None, 'aiohttp is not installed')
+class AsyncDBTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.api = StubAPI()
+        self.server = TestServer(self.api.app)
+        await self.server.start_server()
+        for patch in (mock.patch.object(rundb, 'PREFIX', str(self.server.make_url('')).rstrip('/'),
+                                        create=True),
+                      mock.patch.object(rundb, 'BASE_HEADERS', {}, create=True),
+                      mock.patch.object(asyncdb, 'Token', Token)):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.db = asyncdb.AsyncDB(token_path='unused', pool_size=4)
+        self.db.retry_policy = RetryPolicy(max_retries=0)
+        self.db.circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        self.db.rate_limiter = None
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        await self.server.close()
+
+
+class TestAsyncDB(AsyncDBTestCase):
+
+    async def test_get_docs(self):
+        docs, errors = await self.db.get_docs([3, -1, 1])
+        self.assertEqual(docs, [{'number': 3}, None, {'number': 1}])
+        self.assertEqual(list(errors), [-1])
+        self.assertIsInstance(errors[-1], rundb.APIError)
+        self.assertEqual(errors[-1].status_code, 404)
+
+    async def test_iter_runs(self):
+        numbers = [doc['number'] async for doc in self.db.iter_runs()]
+        self.assertEqual(numbers, [10, 11, 20, 21, 30, 31])
+        # stops at the first empty page
+        self.assertEqual(self.api.pages, [1, 2, 3, 4])
+
+    async def test_iter_runs_stop_early(self):
+        self.api.delay = 0.05
+        runs = self.db.iter_runs()
+        async for doc in runs:
+            break
+        await runs.aclose()
+        self.assertEqual(doc, {'number': 10})
+        # the prefetch of the second page was cancelled, there is no
+        # request for a third one
+        self.assertLessEqual(set(self.api.pages), {1, 2})
+        self.assertEqual(self.db.circuit_breaker.stats['failures'], 0)
+
+    async def test_token_in_executor(self):
+        Token.threads.clear()
+        await self.db.get_doc(1)
+        self.db.token.is_valid = False
+        await self.db.get_doc(1)
+        self.assertEqual(len(Token.threads), 2)
+        self.assertNotIn(threading.get_ident(), Token.threads)
+
+    async def test_max_in_flight(self):
+        await self.db.close()
+        self.db = asyncdb.AsyncDB(token_path='unused', pool_size=4, max_in_flight=2)
+        self.api.delay = 0.02
+        docs, errors = await self.db.get_docs(range(10))
+        self.assertEqual(errors, {})
+        self.assertEqual(self.api.max_in_flight, 2)
+
+
+class TestDownload(AsyncDBTestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.db.retry_policy = RetryPolicy(max_retries=2, backoff=0)
+
+    async def test_download(self):
+        self.api.unavailable = 1
+        path = await self.db.download_file('some_map', save_dir=self.folder.name, chunk_size=4096)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.api.file)
+        self.assertEqual(os.listdir(self.folder.name), ['some_map'])
+        self.assertEqual(self.db.retry_policy.retries, 1)
+
+    async def test_wrong_md5(self):
+        self.api.file_md5 = 'something else'
+        with self.assertRaises(RuntimeError):
+            await self.db.download_file('some_map', save_dir=self.folder.name)
+        self.assertEqual(os.listdir(self.folder.name), [])
+
+    async def test_unavailable(self):
+        self.api.unavailable = 3
+        with self.assertRaises(rundb.APIError):
+            await self.db.download_file('some_map', save_dir=self.folder.name)
+        self.assertEqual(os.listdir(self.folder.name), [])
+
+
+class TestCircuitBreaker(AsyncDBTestCase):
+
+    async def test_cancelled_calls(self):
+        self.api.delay = 1
+        for _ in range(5):
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(self.db.query(1), 0.05)
+        # the API is fine, the callers just did not wait for it
+        self.assertEqual(self.db.circuit_breaker.stats['failures'], 0)
+        self.api.delay = 0
+        self.assertEqual(len(await self.db.query(1)), 2)
+
+    async def test_cancelled_trial(self):
+        self.db.circuit_breaker.record_failure()
+        self.db.circuit_breaker.record_failure()
+        await asyncio.sleep(0.06)
+        self.api.delay = 1
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(self.db.query(1), 0.05)
+        self.assertEqual(self.db.circuit_breaker.stats['state'], 'half-open')
+        # another trial is let through once the lost one expired
+        self.api.delay = 0
+        await asyncio.sleep(0.06)
+        self.assertEqual(len(await self.db.query(1)), 2)
+        self.assertEqual(self.db.circuit_breaker.stats['state'], 'closed')
+
+
+if __name__ == '__main__':
+    unittest.main()
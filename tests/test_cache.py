@@ -0,0 +1,111 @@
+import errno
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from utilix import locking
+from utilix.cache import ResponseCache, DocumentCache
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_hit_and_miss(self):
+        cache = ResponseCache()
+        self.assertIsNone(cache.get('/runs/number/2000'))
+        cache.put('/runs/number/2000', 'doc', 3)
+        self.assertEqual(cache.get('/runs/number/2000'), 'doc')
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['misses'], 1)
+
+    def test_uncached_endpoint(self):
+        cache = ResponseCache()
+        # file downloads should never end up in memory
+        cache.put('/files/some_map.json', 'content', 7)
+        self.assertEqual(len(cache), 0)
+
+    def test_ttl(self):
+        cache = ResponseCache(ttls=((r'^/runs/', 0.01),))
+        cache.put('/runs/number/2000', 'doc', 3)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('/runs/number/2000'))
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(max_entries=2, max_bytes=10)
+        cache.put('/runs/number/1', 'a', 4)
+        cache.put('/runs/number/2', 'b', 4)
+        cache.get('/runs/number/1')
+        cache.put('/runs/number/3', 'c', 4)
+        # 2 was the least recently used
+        self.assertIsNone(cache.get('/runs/number/2'))
+        self.assertEqual(cache.get('/runs/number/1'), 'a')
+        self.assertEqual(cache.stats['evictions'], 1)
+        self.assertEqual(cache.nbytes, 8)
+
+    def test_invalidate(self):
+        cache = ResponseCache()
+        for url in ['/runs/number/200', '/runs/number/200/data',
+                    '/runs/number/2000', '/contexts/1_0/online/peaks']:
+            cache.put(url, url, 1)
+        removed = cache.invalidate('/runs/number/200')
+        self.assertEqual(sorted(removed), ['/runs/number/200', '/runs/number/200/data'])
+        self.assertEqual(cache.get('/runs/number/2000'), '/runs/number/2000')
+        cache.invalidate('/contexts/1_0/online/')
+        self.assertEqual(len(cache), 1)
+
+
+class TestDocumentCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.cache = DocumentCache(self.tempdir.name, ttl=60)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_put_get(self):
+        self.assertIsNone(self.cache.get('2000'))
+        self.cache.put('2000', {'number': 2000})
+        self.assertEqual(self.cache.get('2000'), {'number': 2000})
+        self.cache.invalidate('2000')
+        self.assertIsNone(self.cache.get('2000'))
+
+    def test_expired(self):
+        self.cache.put('2000', {'number': 2000})
+        old = time.time() - 120
+        os.utime(self.cache._path('2000'), (old, old))
+        self.assertIsNone(self.cache.get('2000'))
+
+    def test_single_fetch(self):
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.05)
+            return {'number': 2000}
+
+        threads = [threading.Thread(target=self.cache.get_or_fetch, args=('2000', fetch))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.cache.get('2000'), {'number': 2000})
+        # no lock files are left behind
+        self.assertEqual(os.listdir(self.tempdir.name), ['2000.json'])
+
+    @unittest.skipIf(locking.fcntl is None, 'no flock on this platform')
+    def test_flock_not_supported(self):
+        def flock(fd, operation):
+            raise OSError(errno.ENOLCK, 'No locks available')
+
+        with mock.patch.object(locking.fcntl, 'flock', flock):
+            self.test_single_fetch()
+
+
+if __name__ == '__main__':
+    unittest.main()
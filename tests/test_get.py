@@ -42,6 +42,21 @@ class TestGet(unittest.TestCase):
         #pprint(data)
         self.assertTrue(len(data) > 0)
 
+    def test_docs_bulk(self):
+        db = rundb.DB()
+        docs, errors = db.get_docs([2000, '170917_1819', 2000])
+        self.assertEqual(len(docs), 3)
+        self.assertFalse(errors)
+        self.assertEqual(docs[0]['number'], docs[2]['number'])
+        self.assertEqual(docs[1]['name'], '170917_1819')
+
+    def test_data_bulk_reports_failures(self):
+        db = rundb.DB()
+        data, errors = db.get_data_many([2000, 'not_a_run'])
+        self.assertTrue(len(data[0]) > 0)
+        self.assertIsNone(data[1])
+        self.assertIn('not_a_run', errors)
+
 if __name__ == '__main__':
     unittest.main()
 
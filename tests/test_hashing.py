@@ -0,0 +1,47 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from utilix import hashing
+
+
+class TestHashing(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.path = os.path.join(self.folder.name, 'file')
+        self.content = os.urandom(100_000)
+        with open(self.path, 'wb') as f:
+            f.write(self.content)
+
+    def test_file_md5(self):
+        expected = hashlib.md5(self.content).hexdigest()
+        self.assertEqual(hashing.file_md5(self.path), expected)
+        self.assertEqual(hashing.file_md5(self.path, buffer_size=4096), expected)
+        self.assertEqual(hashing.file_md5(self.path, buffer_size=4096, use_mmap=True), expected)
+
+    def test_empty_file(self):
+        open(self.path, 'wb').close()
+        self.assertEqual(hashing.file_md5(self.path, use_mmap=True), hashlib.md5().hexdigest())
+
+    def test_hash_cache(self):
+        cache = hashing.HashCache(os.path.join(self.folder.name, 'md5.sqlite'))
+        first = cache.md5(self.path)
+        self.assertEqual(cache.md5(self.path), first)
+        self.assertEqual(cache.stats, dict(hits=1, misses=1))
+
+        # changing the file changes its size and mtime
+        with open(self.path, 'ab') as f:
+            f.write(b'more')
+        self.assertEqual(cache.md5(self.path), hashlib.md5(self.content + b'more').hexdigest())
+        self.assertEqual(cache.misses, 2)
+
+    def test_md5_many(self):
+        result = hashing.md5_many([self.path, self.path], use_cache=False)
+        self.assertEqual(result, {self.path: hashlib.md5(self.content).hexdigest()})
+
+
+if __name__ == '__main__':
+    unittest.main()
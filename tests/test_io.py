@@ -0,0 +1,342 @@
+import bz2
+import copy
+import gzip
+import json
+import lzma
+import os
+import pickle
+import tempfile
+import unittest
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from utilix import io
+
+
+class TestReadFile(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+
+    def _path(self, name):
+        return os.path.join(self.folder.name, name)
+
+    def test_lazy_npz(self):
+        np.savez(self._path('a.npz'), a=np.arange(10), b=np.ones(3))
+        result = io.read_file(self._path('a.npz'), lazy=True)
+        self.assertIsInstance(result, io.LazyNpz)
+        self.assertEqual(sorted(result), ['a', 'b'])
+        np.testing.assert_array_equal(result['a'], np.arange(10))
+        # cached, not read again
+        self.assertIs(result['a'], result['a'])
+        with self.assertRaises(KeyError):
+            result['c']
+
+        result.close()
+        np.testing.assert_array_equal(result['a'], np.arange(10))
+        with self.assertRaises(ValueError):
+            result['b']
+
+    def test_lazy_npz_copy(self):
+        np.savez(self._path('a.npz'), a=np.arange(10))
+        with io.read_file(self._path('a.npz'), lazy=True) as result:
+            for copied in (copy.copy(result), copy.deepcopy(result),
+                           pickle.loads(pickle.dumps(result))):
+                self.assertIsInstance(copied, dict)
+                np.testing.assert_array_equal(copied['a'], np.arange(10))
+
+    def test_slurped_npz(self):
+        np.savez(self._path('a.npz'), a=np.arange(10))
+        result = io.read_file(self._path('a.npz'))
+        self.assertIsInstance(result, dict)
+        np.testing.assert_array_equal(result['a'], np.arange(10))
+
+    def test_mmap_npy(self):
+        array = np.arange(100).reshape(10, 10)
+        np.save(self._path('a.npy'), array)
+        result = io.read_file(self._path('a.npy'), mmap_mode='r')
+        self.assertIsInstance(result, np.memmap)
+        np.testing.assert_array_equal(result, array)
+
+    def test_mmap_npz(self):
+        arrays = dict(a=np.arange(100.).reshape(10, 10),
+                      fortran=np.asfortranarray(np.arange(6).reshape(2, 3)),
+                      strings=np.array(['x', 'yy']),
+                      empty=np.zeros(0))
+        np.savez(self._path('a.npz'), **arrays)
+        result = io.read_file(self._path('a.npz'), mmap_mode='r', lazy=True)
+        self.assertEqual(set(result), set(arrays))
+        for key, array in arrays.items():
+            np.testing.assert_array_equal(result[key], array)
+        self.assertIsInstance(result['a'], np.memmap)
+        self.assertIsInstance(result['fortran'], np.memmap)
+
+    def test_mmap_compressed_npz(self):
+        np.savez_compressed(self._path('a.npz'), a=np.arange(10))
+        result = io.read_file(self._path('a.npz'), mmap_mode='r')
+        np.testing.assert_array_equal(result['a'], np.arange(10))
+
+    def test_mmap_binary(self):
+        with open(self._path('a.binary'), 'wb') as f:
+            f.write(b'some bytes')
+        result = io.read_file(self._path('a.binary'), mmap_mode='r')
+        self.assertIsInstance(result, memoryview)
+        self.assertEqual(bytes(result), b'some bytes')
+        self.assertEqual(io.read_file(self._path('a.binary')), b'some bytes')
+
+    def test_bad_mmap_mode(self):
+        with self.assertRaises(ValueError):
+            io.read_file(self._path('a.npy'), mmap_mode='w+')
+
+
+class TestCompressed(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+
+    def _write(self, name, content):
+        path = os.path.join(self.folder.name, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def _contents(self):
+        """The bytes of a file of every format and how it should be read"""
+        array = np.arange(10.)
+        npy = BytesIO()
+        np.save(npy, array)
+        npz = BytesIO()
+        np.savez(npz, a=array)
+        records = [{'a': 1}, {'a': 2}]
+        return {
+            '.npy': (npy.getvalue(), array),
+            '.npz': (npz.getvalue(), {'a': array}),
+            '.pkl': (pickle.dumps(records), records),
+            '.json': (json.dumps(records).encode(), records),
+            '.jsonl': (b'{"a": 1}\n{"a": 2}\n', records),
+            '.binary': (b'some bytes', b'some bytes'),
+            '.txt': (b'some text', 'some text'),
+            '.csv': (b'a\n1\n2\n', pd.DataFrame(records)),
+        }
+
+    def _check(self, suffix, compress):
+        for fmt, (content, expected) in self._contents().items():
+            result = io.read_file(self._write('file' + fmt + suffix, compress(content)))
+            if isinstance(expected, pd.DataFrame):
+                pd.testing.assert_frame_equal(result, expected)
+            elif isinstance(expected, np.ndarray):
+                np.testing.assert_array_equal(result, expected)
+            elif fmt == '.npz':
+                np.testing.assert_array_equal(result['a'], expected['a'])
+            else:
+                self.assertEqual(result, expected, fmt + suffix)
+
+    def test_gzip(self):
+        self._check('.gz', gzip.compress)
+
+    def test_bz2(self):
+        self._check('.bz2', bz2.compress)
+
+    def test_xz(self):
+        self._check('.xz', lzma.compress)
+
+    @unittest.skipIf(io.zstandard is None, 'zstandard is not installed')
+    def test_zstd(self):
+        self._check('.zst', io.zstandard.ZstdCompressor().compress)
+
+    @unittest.skipIf(io.lz4 is None, 'lz4 is not installed')
+    def test_lz4(self):
+        self._check('.lz4', io.lz4.frame.compress)
+
+    def test_iter_compressed_csv(self):
+        path = self._write('a.csv.xz', lzma.compress(b'a,b\n1,2\n3,4\n'))
+        result = pd.concat(io.iter_csv(path, chunksize=1, columns=['b'], engine='pandas'))
+        self.assertEqual(list(result['b']), [2, 4])
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            io.read_file(self._write('a.foo.gz', gzip.compress(b'')))
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.frame = pd.DataFrame({'a': np.arange(25), 'b': np.arange(25) / 2, 'c': ['x'] * 25})
+
+    def _path(self, name):
+        return os.path.join(self.folder.name, name)
+
+    def test_iter_csv(self):
+        self.frame.to_csv(self._path('a.csv'), index=False)
+        chunks = list(io.iter_csv(self._path('a.csv'), chunksize=10, columns=['a', 'b'],
+                                  dtype={'a': np.int32}, engine='pandas'))
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+        result = pd.concat(chunks)
+        self.assertEqual(list(result.columns), ['a', 'b'])
+        self.assertEqual(result['a'].dtype, np.int32)
+        np.testing.assert_array_equal(result['b'], self.frame['b'])
+
+    def test_iter_csv_mixed_types(self):
+        # a column that only turns out to be float in the last row
+        with open(self._path('a.csv'), 'w') as f:
+            f.write('a\n' + '1\n' * 1000 + '1.5\n')
+        for engine in ('pandas', 'auto'):
+            result = pd.concat(io.iter_csv(self._path('a.csv'), chunksize=100, engine=engine))
+            self.assertEqual(result['a'].iloc[-1], 1.5)
+
+    @unittest.skipIf(io.pyarrow is None, 'pyarrow is not installed')
+    def test_iter_csv_pyarrow(self):
+        self.frame.to_csv(self._path('a.csv'), index=False)
+        result = pd.concat(io.iter_csv(self._path('a.csv'), columns=['a', 'b'],
+                                       dtype={'a': np.int32}, engine='pyarrow'))
+        self.assertEqual(result['a'].dtype, np.int32)
+        np.testing.assert_array_equal(result['b'], self.frame['b'])
+
+    def test_iter_jsonl(self):
+        records = self.frame.to_dict('records')
+        with gzip.open(self._path('a.jsonl.gz'), 'wt') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        self.assertEqual(list(io.iter_jsonl(self._path('a.jsonl.gz'))), records)
+        self.assertEqual(io.read_file(self._path('a.jsonl.gz')), records)
+
+        chunks = list(io.iter_jsonl(self._path('a.jsonl.gz'), columns=['a', 'c'], chunksize=10,
+                                    dtype={'a': np.int16}))
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+        self.assertEqual(list(chunks[0].columns), ['a', 'c'])
+        self.assertEqual(chunks[0]['a'].dtype, np.int16)
+
+
+class TestRunlist(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+
+    def _path(self, name):
+        return os.path.join(self.folder.name, name)
+
+    def test_text(self):
+        for suffix in ('.txt', '.text'):
+            with open(self._path('runs' + suffix), 'w') as f:
+                f.write('5\n3\n# some comment\n1000-1003\n7, 8\n5\n')
+            runs = io.load_runlist(self._path('runs' + suffix))
+            self.assertEqual(runs.dtype, np.int64)
+            np.testing.assert_array_equal(runs, [3, 5, 7, 8, 1000, 1001, 1002, 1003])
+
+    def test_compressed_text(self):
+        with gzip.open(self._path('runs.txt.gz'), 'wt') as f:
+            f.write('2\n1\n')
+        np.testing.assert_array_equal(io.load_runlist(self._path('runs.txt.gz')), [1, 2])
+
+    def test_npy(self):
+        np.save(self._path('runs.npy'), np.array([3, 1, 3], dtype=np.int32))
+        runs = io.load_runlist(self._path('runs.npy'))
+        self.assertEqual(runs.dtype, np.int64)
+        np.testing.assert_array_equal(runs, [1, 3])
+
+    def test_bad_input(self):
+        with self.assertRaises(ValueError):
+            io.load_runlist(self._path('runs.csv'))
+        with self.assertRaises(ValueError):
+            io.parse_runlist('1\nnot_a_run\n')
+        with self.assertRaises(ValueError):
+            io.parse_runlist('2000-1000')
+        self.assertEqual(len(io.parse_runlist(' \n')), 0)
+
+    def test_set_operations(self):
+        a = np.array([1, 2, 3, 4])
+        b = np.array([3, 4, 5])
+        np.testing.assert_array_equal(io.runlist_union(a, b, [9]), [1, 2, 3, 4, 5, 9])
+        np.testing.assert_array_equal(io.runlist_intersection(a, b), [3, 4])
+        np.testing.assert_array_equal(io.runlist_difference(a, b), [1, 2])
+        np.testing.assert_array_equal(io.runlist_union(a, []), a)
+        np.testing.assert_array_equal(io.isin_runlist([1, 5], a), [True, False])
+        self.assertTrue(io.isin_runlist(2, a))
+
+
+class TestMemoizedReader(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.path = os.path.join(self.folder.name, 'a.npy')
+        np.save(self.path, np.arange(100))
+
+    def test_hit(self):
+        reader = io.MemoizedReader()
+        first = reader.read_file(self.path)
+        self.assertIs(reader.read_file(self.path), first)
+        self.assertEqual(reader.stats['hits'], 1)
+        self.assertEqual(reader.stats['misses'], 1)
+        self.assertEqual(reader.nbytes, first.nbytes)
+
+    def test_readonly(self):
+        result = io.MemoizedReader().read_file(self.path)
+        with self.assertRaises(ValueError):
+            result[0] = 1
+
+    def test_changed_file(self):
+        reader = io.MemoizedReader()
+        reader.read_file(self.path)
+        np.save(self.path, np.arange(200))
+        self.assertEqual(len(reader.read_file(self.path)), 200)
+        self.assertEqual(reader.stats['misses'], 2)
+
+    def test_key(self):
+        reader = io.MemoizedReader()
+        first = reader.read_file(self.path, key='some_md5')
+        self.assertIs(reader.read_file(self.path, key='some_md5'), first)
+        # other arguments to read_file give another result
+        self.assertIsNot(reader.read_file(self.path, key='some_md5', mmap_mode='r'), first)
+
+    def test_copies(self):
+        reader = io.MemoizedReader()
+        json_path = os.path.join(self.folder.name, 'a.json')
+        with open(json_path, 'w') as f:
+            json.dump({'a': [1, 2], 'b': 3}, f)
+        reader.read_file(json_path).pop('a')
+        reader.read_file(json_path)['b'] = 4
+        self.assertEqual(reader.read_file(json_path), {'a': [1, 2], 'b': 3})
+
+        csv_path = os.path.join(self.folder.name, 'a.csv')
+        pd.DataFrame({'x': [1, 2]}).to_csv(csv_path, index=False)
+        result = reader.read_file(csv_path)
+        result['x'] *= 10
+        self.assertEqual(reader.read_file(csv_path)['x'].tolist(), [1, 2])
+        self.assertEqual(reader.stats['hits'], 3)
+
+    def test_npz(self):
+        npz_path = os.path.join(self.folder.name, 'a.npz')
+        np.savez(npz_path, a=np.arange(10), b=np.ones(3))
+        reader = io.MemoizedReader()
+        first = reader.read_file(npz_path)
+        first['c'] = np.zeros(1)
+        second = reader.read_file(npz_path)
+        self.assertEqual(sorted(second), ['a', 'b'])
+        self.assertIs(second['a'], first['a'])
+
+        # lazily read files are closed by their users, not cached
+        with reader.read_file(npz_path, lazy=True) as result:
+            self.assertIsInstance(result, io.LazyNpz)
+        np.testing.assert_array_equal(reader.read_file(npz_path, lazy=True)['b'], np.ones(3))
+        self.assertEqual(len(reader), 1)
+
+    def test_eviction(self):
+        other = os.path.join(self.folder.name, 'b.npy')
+        np.save(other, np.arange(100))
+        reader = io.MemoizedReader(max_bytes=1000)
+        reader.read_file(self.path)
+        reader.read_file(other)
+        self.assertEqual(reader.stats['evictions'], 1)
+        self.assertEqual(len(reader), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
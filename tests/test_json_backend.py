@@ -0,0 +1,28 @@
+import unittest
+
+from utilix import json_backend
+
+
+class TestJsonBackend(unittest.TestCase):
+
+    def tearDown(self):
+        json_backend.set_backend()
+
+    def test_backends(self):
+        for backend in json_backend.BACKENDS:
+            json_backend.set_backend(backend)
+            self.assertEqual(json_backend.loads(b'{"results": [1, "a"]}'),
+                             {'results': [1, 'a']})
+
+    def test_nan(self):
+        # python's json (and hence the API) can write NaN
+        result = json_backend.loads(b'{"results": NaN}')['results']
+        self.assertNotEqual(result, result)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            json_backend.set_backend('not_a_backend')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import errno
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from utilix import locking
+
+
+class TestTargetLock(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.target = os.path.join(self.folder.name, 'file')
+
+    def _check_exclusive(self):
+        inside = []
+        overlaps = []
+
+        def work():
+            with locking.target_lock(self.target, poll_interval=0.01):
+                inside.append(1)
+                overlaps.append(len(inside) > 1)
+                time.sleep(0.02)
+                inside.pop()
+
+        threads = [threading.Thread(target=work) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(overlaps, [False] * 5)
+
+    def test_exclusive(self):
+        self._check_exclusive()
+        self.assertFalse(os.path.exists(self.target + '.lock'))
+
+    def test_exclusive_without_flock(self):
+        with mock.patch.object(locking, 'fcntl', None):
+            self._check_exclusive()
+            self.assertFalse(os.path.exists(self.target + '.lock'))
+
+    def test_flock_not_supported(self):
+        def flock(fd, operation):
+            raise OSError(errno.ENOLCK, 'No locks available')
+
+        with mock.patch.object(locking.fcntl, 'flock', flock):
+            with locking.target_lock(self.target, timeout=1, poll_interval=0.01):
+                with open(self.target + '.lock') as f:
+                    self.assertEqual(int(f.read().split()[0]), os.getpid())
+            self.assertFalse(os.path.exists(self.target + '.lock'))
+            self._check_exclusive()
+
+    def test_timeout(self):
+        with locking.target_lock(self.target):
+            with self.assertRaises(locking.LockTimeout):
+                with locking.target_lock(self.target, timeout=0.05, poll_interval=0.01):
+                    pass
+
+    def test_stale_lock_file(self):
+        # a lock file left behind by a process that died
+        with open(self.target + '.lock', 'w') as f:
+            f.write(f'999999999 {locking.socket.gethostname()} {time.time()}')
+        with mock.patch.object(locking, 'fcntl', None):
+            with locking.target_lock(self.target, timeout=1):
+                with open(self.target + '.lock') as f:
+                    self.assertEqual(int(f.read().split()[0]), os.getpid())
+
+    def test_untouched_lock_file(self):
+        with open(self.target + '.lock', 'w') as f:
+            f.write('1 some_other_host 0')
+        with mock.patch.object(locking, 'fcntl', None):
+            with self.assertRaises(locking.LockTimeout):
+                with locking.target_lock(self.target, timeout=0.05, poll_interval=0.01):
+                    pass
+            os.utime(self.target + '.lock', (0, 0))
+            with locking.target_lock(self.target, timeout=1):
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()
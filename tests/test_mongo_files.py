@@ -0,0 +1,187 @@
+import hashlib
+import os
+import tempfile
+import time
+import unittest
+import warnings
+
+from utilix import mongo_files
+
+
+class FakeChunks:
+    """The fs.chunks collection of a single file"""
+
+    def __init__(self, files_id, content, chunk_size):
+        self.docs = [{'files_id': files_id, 'n': n, 'data': content[start:start + chunk_size]}
+                     for n, start in enumerate(range(0, len(content), chunk_size))]
+
+    def find(self, query, sort=None):
+        n = query['n']
+        return [doc for doc in self.docs
+                if doc['files_id'] == query['files_id'] and n['$gte'] <= doc['n'] < n['$lt']]
+
+
+class FakeCollection:
+
+    def __init__(self, chunks):
+        self.database = {'fs.chunks': chunks}
+
+
+class FakeGridOut:
+
+    def __init__(self, content, chunk_size):
+        self._id = 'some_id'
+        self.length = len(content)
+        self.chunk_size = chunk_size
+        self.md5 = hashlib.md5(content).hexdigest()
+
+
+class TestParallelDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.destination = os.path.join(self.folder.name, 'some_map')
+        # the last chunk is not full
+        self.content = os.urandom(10 * 1000 + 123)
+        self.fs_object = FakeGridOut(self.content, chunk_size=1000)
+        self.chunks = FakeChunks('some_id', self.content, chunk_size=1000)
+        self.downloader = mongo_files.MongoDownloader.__new__(mongo_files.MongoDownloader)
+        self.downloader.collection = FakeCollection(self.chunks)
+
+    def _download(self):
+        self.downloader.parallel_download_to_file(self.fs_object, self.destination,
+                                                  n_workers=3, chunks_per_task=2)
+
+    def test_download(self):
+        self._download()
+        with open(self.destination, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(os.listdir(self.folder.name), ['some_map'])
+
+    def test_missing_chunk(self):
+        del self.chunks.docs[4]
+        with self.assertRaises(mongo_files.CouldNotLoadError):
+            self._download()
+        self.assertEqual(os.listdir(self.folder.name), [])
+
+    def test_wrong_md5(self):
+        self.chunks.docs[4]['data'] = os.urandom(1000)
+        with self.assertRaises(mongo_files.CouldNotLoadError):
+            self._download()
+        self.assertEqual(os.listdir(self.folder.name), [])
+
+
+class TestRunConcurrently(unittest.TestCase):
+
+    def test_order_and_errors(self):
+        def transfer(name, delay):
+            time.sleep(delay)
+            if name == 'broken':
+                raise mongo_files.CouldNotLoadError(name)
+            return name.upper()
+
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter('always')
+            results = mongo_files.run_concurrently(
+                transfer, [('a', 0.03), ('broken', 0.02), ('c', 0)], max_workers=3)
+        # in the order of the arguments, not of completion
+        self.assertEqual(list(results), ['a', 'broken', 'c'])
+        self.assertEqual(results['a'], 'A')
+        self.assertIsInstance(results['broken'], mongo_files.CouldNotLoadError)
+        self.assertEqual(results['c'], 'C')
+
+    def test_unexpected_error(self):
+        def transfer(name):
+            raise KeyError(name)
+
+        with self.assertRaises(KeyError):
+            mongo_files.run_concurrently(transfer, [('a',)], max_workers=1)
+
+
+class FakeUploader(mongo_files.GridFsBase, mongo_files.GridFsUploadBase):
+    """Keeps the documents of the uploaded files in memory"""
+
+    def __init__(self, docs=()):
+        super().__init__()
+        self.docs = list(docs)
+        self.uploaded = []
+
+    def find_files(self, query, projection):
+        def match(doc):
+            return all(doc.get(key) in condition['$in'] for key, condition in query.items())
+        return [{key: doc[key] for key in projection if key in doc}
+                for doc in self.docs if match(doc)]
+
+    @staticmethod
+    def compute_md5(abs_path, use_cache=False):
+        return mongo_files.GridFsBase.compute_md5(abs_path, use_cache=False)
+
+    def upload_single(self, config, abs_path):
+        if not os.path.exists(abs_path):
+            raise mongo_files.CouldNotLoadError(f'{abs_path} does not exist')
+        self.uploaded.append(config)
+        self.docs.append({'config_name': config, 'md5': self.compute_md5(abs_path)})
+
+
+class TestStoredFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.interface = FakeUploader([{'config_name': 'a', 'md5': '1'},
+                                       {'config_name': 'a', 'md5': '2'},
+                                       {'config_name': 'b', 'md5': '3'}])
+
+    def test_stored_files(self):
+        stored = self.interface.stored_files([('a', '2'), ('b', '1'), ('c', '3'), ('b', '3')])
+        # b is stored, and so is the md5 1, but not b with md5 1
+        self.assertEqual(stored, {('a', '2'), ('b', '3')})
+        self.assertEqual(self.interface.stored_files([]), set())
+
+    def test_configs_and_md5s(self):
+        self.assertEqual(self.interface.configs_exist(['a', 'c']), {'a'})
+        self.assertEqual(self.interface.md5s_stored(['3', '4']), {'3'})
+
+
+class TestUploadFromDict(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.paths = {}
+        self.md5s = {}
+        for name in ('a', 'b', 'c'):
+            path = os.path.join(self.folder.name, name)
+            with open(path, 'wb') as f:
+                f.write(name.encode() * 100)
+            self.paths[name] = path
+            self.md5s[name] = hashlib.md5(name.encode() * 100).hexdigest()
+
+    def test_skip_and_upload(self):
+        uploader = FakeUploader([
+            # the same file under the same name
+            {'config_name': 'a', 'md5': self.md5s['a']},
+            # an older version of b, and the content of c under another name
+            {'config_name': 'b', 'md5': 'old'},
+            {'config_name': 'other', 'md5': self.md5s['c']},
+        ])
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter('always')
+            results = uploader.upload_from_dict(
+                {**self.paths, 'missing': os.path.join(self.folder.name, 'missing')})
+        self.assertEqual(results['a'], 'skipped')
+        self.assertEqual(results['b'], 'uploaded')
+        self.assertEqual(results['c'], 'uploaded')
+        self.assertIsInstance(results['missing'], mongo_files.CouldNotLoadError)
+        self.assertEqual(sorted(uploader.uploaded), ['b', 'c'])
+
+        # now everything is stored
+        results = uploader.upload_from_dict(self.paths)
+        self.assertEqual(set(results.values()), {'skipped'})
+
+    def test_not_a_dict(self):
+        with self.assertRaises(ValueError):
+            FakeUploader().upload_from_dict([self.paths['a']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -33,6 +33,16 @@ class TestQuery(unittest.TestCase):
         #pprint(data)
         self.assertTrue(len(data) > 0)
 
+    def test_iter_runs(self):
+        db = rundb.DB()
+        numbers = []
+        for doc in db.iter_runs(source='calibration'):
+            numbers.append(doc['number'])
+            if len(numbers) == 1500:
+                break
+        # crossed a page boundary without duplicates
+        self.assertEqual(len(set(numbers)), len(numbers))
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,82 @@
+import configparser
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from utilix import ratelimit
+from utilix.ratelimit import RateLimiter
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_no_limit(self):
+        limiter = RateLimiter()
+        self.assertEqual(limiter.reserve(), 0)
+
+    def test_burst_then_rate(self):
+        limiter = RateLimiter(rate=10, burst=2)
+        waits = [limiter.reserve() for _ in range(4)]
+        self.assertEqual(waits[:2], [0, 0])
+        # the next requests are queued 1/rate apart
+        self.assertAlmostEqual(waits[2], 0.1, delta=0.01)
+        self.assertAlmostEqual(waits[3], 0.2, delta=0.01)
+
+    def test_shared_file(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, 'rate_limit')
+            limiters = [RateLimiter(rate=10, burst=1, shared_file=path) for _ in range(2)]
+            self.assertEqual(limiters[0].reserve(), 0)
+            # the second limiter sees the token taken by the first one
+            self.assertGreater(limiters[1].reserve(), 0.05)
+
+    def test_max_in_flight(self):
+        limiter = RateLimiter(max_in_flight=2)
+        in_flight = []
+        peak = []
+        lock = threading.Lock()
+
+        def call():
+            with limiter:
+                with lock:
+                    in_flight.append(1)
+                    peak.append(len(in_flight))
+                time.sleep(0.02)
+                with lock:
+                    in_flight.pop()
+
+        threads = [threading.Thread(target=call) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(max(peak), 2)
+
+
+class TestMaxInFlightConfig(unittest.TestCase):
+
+    def _max_in_flight(self, value):
+        config = configparser.ConfigParser()
+        config['RunDB'] = {} if value is None else {'api_max_in_flight': value}
+        with mock.patch.object(ratelimit, 'uconfig', config):
+            return ratelimit.max_in_flight_from_config()
+
+    def test_no_limit(self):
+        for value in (None, '', '0'):
+            self.assertIsNone(self._max_in_flight(value))
+        self.assertEqual(self._max_in_flight('8'), 8)
+
+    def test_async_db(self):
+        try:
+            from utilix.asyncdb import AsyncDB
+            db = AsyncDB(token_path='unused', pool_size=4, max_in_flight=0)
+        except ImportError:
+            self.skipTest('aiohttp is not installed')
+        self.assertEqual(db.max_in_flight, 4)
+        self.assertEqual(AsyncDB(token_path='unused', max_in_flight=2).max_in_flight, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from utilix import mongo_files
+from utilix.mongo_files import GridFsDownloadBase, upload_timestamp
+from utilix.resource_cache import ResourceCache, parse_size
+
+
+class TestResourceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+
+    def _write(self, name, size):
+        path = os.path.join(self.folder.name, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def test_lookup(self):
+        cache = ResourceCache(self.folder.name)
+        self.assertIsNone(cache.lookup('abc'))
+        path = cache.add('abc', self._write('abc', 10), name='some_map')
+        self.assertEqual(cache.lookup('abc'), path)
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['nbytes'], 10)
+
+    def test_removed_file(self):
+        cache = ResourceCache(self.folder.name)
+        os.remove(cache.add('abc', self._write('abc', 10)))
+        self.assertIsNone(cache.lookup('abc'))
+        self.assertEqual(cache.stats['entries'], 0)
+
+    def test_lru(self):
+        cache = ResourceCache(self.folder.name, quota=25)
+        a = cache.add('a', self._write('a', 10))
+        b = cache.add('b', self._write('b', 10))
+        cache.lookup('a')
+        cache.add('c', self._write('c', 10))
+        # b was the least recently used
+        self.assertFalse(os.path.exists(b))
+        self.assertTrue(os.path.exists(a))
+        self.assertEqual(cache.stats['nbytes'], 20)
+
+    def test_lfu(self):
+        cache = ResourceCache(self.folder.name, quota=25, policy='lfu')
+        a = cache.add('a', self._write('a', 10))
+        b = cache.add('b', self._write('b', 10))
+        cache.lookup('a')
+        cache.lookup('a')
+        cache.lookup('b')
+        # the new file is never evicted straight away
+        c = cache.add('c', self._write('c', 10))
+        self.assertFalse(os.path.exists(b))
+        self.assertTrue(os.path.exists(a))
+        self.assertTrue(os.path.exists(c))
+
+    def test_gc(self):
+        self._write('abc', 10)
+        self._write('abc.part', 5)
+        cache = ResourceCache(self.folder.name)
+        result = cache.gc(max_partial_age=-1)
+        self.assertEqual(result['added'], 1)
+        self.assertEqual(result['removed_partial'], 1)
+        self.assertIsNotNone(cache.lookup('abc'))
+
+    def test_md5s(self):
+        cache = ResourceCache(self.folder.name)
+        self.assertEqual(cache.get_md5('some_map'), (None, None))
+        cache.put_md5s({'some_map': 'abc'})
+        # shared with other instances (processes) using the folder
+        md5, age = ResourceCache(self.folder.name).get_md5('some_map')
+        self.assertEqual(md5, 'abc')
+        self.assertLess(age, 60)
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('2k'), 2048)
+        self.assertEqual(parse_size('1.5G'), int(1.5 * 1024 ** 3))
+        self.assertEqual(parse_size(100), 100)
+        with self.assertRaises(ValueError):
+            parse_size('lots')
+
+
+class TestFindCached(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        with open(os.path.join(self.folder.name, 'abc123'), 'wb') as f:
+            f.write(b'x')
+
+    def test_indexed(self):
+        downloader = GridFsDownloadBase(store_files_at=(self.folder.name,))
+        path = downloader.find_cached('abc123', 'some_map')
+        self.assertEqual(path, os.path.join(self.folder.name, 'abc123'))
+        self.assertEqual(downloader.resource_cache.lookup('abc123'), path)
+        self.assertIsNone(downloader.find_cached('def456'))
+
+    def test_read_only_folder(self):
+        downloader = GridFsDownloadBase(store_files_at=(self.folder.name,))
+        with mock.patch('os.access', return_value=False):
+            self.assertIsNone(downloader.resource_cache)
+            self.assertEqual(downloader.find_cached('abc123'),
+                             os.path.join(self.folder.name, 'abc123'))
+            self.assertIsNone(downloader.find_cached('def456'))
+        self.assertFalse(os.path.exists(os.path.join(self.folder.name, '.utilix_index.sqlite')))
+
+
+class FilesDB:
+    """Answers get_files with the documents of two versions of a file"""
+
+    def get_files(self, query, projection=None):
+        return [{'config_name': 'some_map', 'md5': 'new',
+                 'uploadDate': 'Fri, 23 Oct 2015 07:28:00 GMT'},
+                {'config_name': 'some_map', 'md5': 'old',
+                 'uploadDate': 'Thu, 22 Jan 2015 07:28:00 GMT'}]
+
+
+class TestRefreshMd5s(unittest.TestCase):
+
+    def test_upload_timestamp(self):
+        timestamp = 1445412480
+        for upload_date in ('Wed, 21 Oct 2015 07:28:00 GMT',
+                            '2015-10-21T07:28:00Z',
+                            {'$date': timestamp * 1000},
+                            {'$date': {'$numberLong': str(timestamp * 1000)}},
+                            {'$date': '2015-10-21T07:28:00.000Z'}):
+            self.assertEqual(upload_timestamp(upload_date), timestamp)
+        self.assertEqual(upload_timestamp(None), float('-inf'))
+
+    def test_latest_version(self):
+        with tempfile.TemporaryDirectory() as folder, \
+                mock.patch.object(mongo_files, 'DB', FilesDB):
+            downloader = mongo_files.APIDownloader(store_files_at=(folder,))
+            self.assertEqual(downloader.refresh_md5s(['some_map']), {'some_map': 'new'})
+            self.assertEqual(downloader.get_md5('some_map'), 'new')
+
+
+if __name__ == '__main__':
+    unittest.main()
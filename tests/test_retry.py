@@ -0,0 +1,61 @@
+import time
+import unittest
+
+from utilix.retry import RetryPolicy, CircuitBreaker
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_backoff(self):
+        policy = RetryPolicy(backoff=1, max_backoff=5)
+        for attempt in range(10):
+            delay = policy.delay(attempt)
+            self.assertTrue(0 <= delay <= min(5, 2 ** attempt))
+
+    def test_retry_after(self):
+        policy = RetryPolicy(max_backoff=30)
+        self.assertEqual(policy.delay(0, '7'), 7)
+        self.assertEqual(policy.delay(0, '120'), 30)
+        self.assertEqual(policy.delay(0, 'Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_open_and_reset(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.stats['state'], 'open')
+
+        time.sleep(0.06)
+        # a single trial call is let through
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.stats['opened'], 1)
+        self.assertEqual(breaker.stats['rejected'], 2)
+
+    def test_failed_trial(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure()
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+    def test_lost_trial(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure()
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        # nothing recorded for the trial
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+
+
+if __name__ == '__main__':
+    unittest.main()
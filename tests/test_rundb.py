@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from urllib.parse import urlsplit, parse_qs
+
+import requests
+
+from utilix import rundb
+from utilix.retry import RetryPolicy, CircuitBreaker
+
+DATA = [
+    {'host': 'rucio-catalogue', 'type': 'peaks', 'status': 'transferred',
+     'did': 'xnt_000001:peaks-abc', 'location': 'SITE_A'},
+    {'host': 'rucio-catalogue', 'type': 'peaks', 'status': 'transferring',
+     'did': 'xnt_000001:peaks-abc', 'location': 'SITE_B'},
+    {'host': 'rucio-catalogue', 'type': 'records', 'status': 'transferred',
+     'did': 'xnt_000001:records-def', 'location': 'SITE_C'},
+    {'host': 'daq', 'type': 'peaks', 'status': 'transferred', 'location': '/data/xenonnt'},
+]
+
+
+class Response:
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.content = json.dumps(body).encode()
+        self.text = self.content.decode()
+        self.headers = {}
+
+    def close(self):
+        pass
+
+
+class StubSession:
+    """Answers the data requests like the API does, honouring the filters
+    and projection if pushdown is True"""
+
+    def __init__(self, pushdown=True):
+        self.pushdown = pushdown
+        self.urls = []
+
+    def get(self, url, headers=None, stream=False):
+        self.urls.append(url)
+        url = urlsplit(url)
+        params = parse_qs(url.query)
+        if params and not self.pushdown:
+            return Response(400, {'error': 'unknown parameters'})
+        data = DATA
+        if 'filters' in params:
+            filters = json.loads(params['filters'][0])
+            data = [d for d in data if all(d.get(k) == v for k, v in filters.items())]
+        if 'projection' in params:
+            projection = params['projection'][0].split(',')
+            data = [{k: d[k] for k in projection if k in d} for d in data]
+        return Response(200, {'results': {'number': 1, 'data': data}})
+
+
+def stub_db(session):
+    """A DB that talks to session, without a token or config"""
+    db = rundb.DB.__new__(rundb.DB)
+    db.session = session
+    db.headers = {}
+    db.cache = None
+    db.doc_cache = None
+    db.retry_policy = RetryPolicy(max_retries=0)
+    db.circuit_breaker = CircuitBreaker()
+    db.rate_limiter = None
+    db.pushdown = True
+    return db
+
+
+@mock.patch.object(rundb, 'PREFIX', 'http://rundb', create=True)
+class TestGetData(unittest.TestCase):
+
+    def test_filter_on_projected_out_field(self):
+        for pushdown in (True, False):
+            db = stub_db(StubSession(pushdown=pushdown))
+            self.assertEqual(db.get_data(1, projection=['location'], type='peaks'),
+                             [{'location': 'SITE_A'}, {'location': 'SITE_B'},
+                              {'location': '/data/xenonnt'}])
+            self.assertEqual(db.pushdown, pushdown)
+
+    def test_get_rses(self):
+        for pushdown in (True, False):
+            db = stub_db(StubSession(pushdown=pushdown))
+            self.assertEqual(db.get_rses(1, 'peaks', 'abc'), ['SITE_A'])
+
+    def test_no_filters(self):
+        session = StubSession()
+        db = stub_db(session)
+        self.assertEqual(db.get_data(1), DATA)
+        self.assertEqual(session.urls, ['http://rundb/runs/number/1/data'])
+
+
+class FailingSession:
+    """Raises the given exceptions, then answers with an empty result"""
+
+    def __init__(self, *exceptions):
+        self.exceptions = list(exceptions)
+        self.calls = 0
+
+    def get(self, url, headers=None, stream=False):
+        self.calls += 1
+        if self.exceptions:
+            raise self.exceptions.pop(0)
+        return Response(200, {'results': {}})
+
+
+@mock.patch.object(rundb, 'PREFIX', 'http://rundb', create=True)
+class TestResponder(unittest.TestCase):
+
+    def test_retry_connection_error(self):
+        session = FailingSession(requests.ConnectionError())
+        db = stub_db(session)
+        db.retry_policy = RetryPolicy(max_retries=1, backoff=0)
+        self.assertEqual(db.query(1), {})
+        self.assertEqual(session.calls, 2)
+        self.assertEqual(db.circuit_breaker.stats['state'], 'closed')
+
+    def test_unexpected_error_is_a_failure(self):
+        session = FailingSession(requests.ConnectionError(),
+                                 requests.exceptions.ChunkedEncodingError())
+        db = stub_db(session)
+        db.circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        with self.assertRaises(requests.ConnectionError):
+            db.query(1)
+        with self.assertRaises(rundb.CircuitOpenError):
+            db.query(1)
+
+        time.sleep(0.06)
+        # the trial call fails with an error that is not retried
+        with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+            db.query(1)
+        self.assertEqual(db.circuit_breaker.stats['state'], 'open')
+
+        time.sleep(0.06)
+        self.assertEqual(db.query(1), {})
+        self.assertEqual(db.circuit_breaker.stats['state'], 'closed')
+
+    def test_interrupt_is_not_a_failure(self):
+        db = stub_db(FailingSession(KeyboardInterrupt()))
+        with self.assertRaises(KeyboardInterrupt):
+            db.query(1)
+        self.assertEqual(db.circuit_breaker.stats['failures'], 0)
+
+
+class FileResponse:
+    """A streamed response with (part of) the bytes of a file"""
+
+    def __init__(self, status_code, content=b''):
+        self.status_code = status_code
+        self.content = content
+        self.text = ''
+        self.headers = {}
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FileSession:
+    """Serves a single file from GridFS, with or without Range requests"""
+
+    def __init__(self, content, ranges=True):
+        self.content = content
+        self.md5 = hashlib.md5(content).hexdigest()
+        self.ranges = ranges
+        self.requested = []
+
+    def get(self, url, headers=None, stream=False):
+        if url.endswith('/md5'):
+            return Response(200, {'results': self.md5})
+        byte_range = (headers or {}).get('Range')
+        self.requested.append(byte_range)
+        if byte_range is None or not self.ranges:
+            return FileResponse(200, self.content)
+        start = int(byte_range[len('bytes='):-1])
+        if start >= len(self.content):
+            return FileResponse(416)
+        return FileResponse(206, self.content[start:])
+
+
+@mock.patch.object(rundb, 'PREFIX', 'http://rundb', create=True)
+class TestStreamFile(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.session = FileSession(os.urandom(10_000))
+        self.db = stub_db(self.session)
+        self.write_to = os.path.join(self.folder.name, 'some_map')
+        self.part_path = f'{self.write_to}.{self.session.md5}.part'
+
+    def _check_file(self):
+        with open(self.write_to, 'rb') as f:
+            self.assertEqual(f.read(), self.session.content)
+        self.assertEqual(os.listdir(self.folder.name), ['some_map'])
+
+    def _write_part(self, content):
+        with open(self.part_path, 'wb') as f:
+            f.write(content)
+
+    def test_download(self):
+        self.db.download_file('some_map', save_dir=self.folder.name, chunk_size=1024)
+        self._check_file()
+        self.assertEqual(self.session.requested, [None])
+
+    def test_resume(self):
+        self._write_part(self.session.content[:4000])
+        self.db.stream_file('some_map', self.write_to, chunk_size=1024)
+        self._check_file()
+        self.assertEqual(self.session.requested, ['bytes=4000-'])
+
+    def test_no_range_support(self):
+        # the server answers with the whole file (200 instead of 206)
+        self.session.ranges = False
+        self._write_part(self.session.content[:4000])
+        self.db.stream_file('some_map', self.write_to, chunk_size=1024)
+        self._check_file()
+
+    def test_range_not_satisfiable(self):
+        self._write_part(os.urandom(20_000))
+        self.db.stream_file('some_map', self.write_to, chunk_size=1024)
+        self._check_file()
+        self.assertEqual(self.session.requested, ['bytes=20000-', None])
+
+    def test_corrupt_part(self):
+        self._write_part(os.urandom(4000))
+        self.db.stream_file('some_map', self.write_to, chunk_size=1024)
+        self._check_file()
+        self.assertEqual(self.session.requested, ['bytes=4000-', None])
+
+    def test_other_version(self):
+        # left over from a download of an older version of the file
+        with open(self.write_to + '.0123456789abcdef.part', 'wb') as f:
+            f.write(os.urandom(4000))
+        self.db.stream_file('some_map', self.write_to, chunk_size=1024)
+        with open(self.write_to, 'rb') as f:
+            self.assertEqual(f.read(), self.session.content)
+        self.assertEqual(self.session.requested, [None])
+
+    def test_wrong_md5(self):
+        with self.assertRaises(RuntimeError):
+            self.db.stream_file('some_map', self.write_to, chunk_size=1024, md5='something else')
+        self.assertEqual(os.listdir(self.folder.name), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,4 +14,5 @@ else:
     logger = config.setup_logger()
 
 from .rundb import DB, xent_collection, xe1t_collection
+from .asyncdb import AsyncDB
 from .mongo_files import MongoUploader, MongoDownloader, APIUploader, APIDownloader
@@ -0,0 +1,384 @@
+"""
+asyncio version of the runDB API client.
+
+AsyncDB mirrors the public API of utilix.rundb.DB, but all the calls are
+coroutines that share one aiohttp connection pool, so they can be used
+from asyncio based services without blocking the event loop. Requires
+aiohttp (pip install utilix[async]).
+"""
+
+import asyncio
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import tempfile
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from . import uconfig, rundb, json_backend
+from .retry import RetryPolicy, CircuitBreaker
+from .ratelimit import RateLimiter, max_in_flight_from_config
+from .locking import target_lock
+from .rundb import (Token, DB, APIError, CircuitOpenError, check_status, cleanup_datadict,
+                    default_token_path, filter_data, data_query_string, logger)
+
+
+class AsyncDB:
+    """asyncio wrapper around the RunDB API"""
+
+    def __init__(self, token_path=None, pool_size=None, max_in_flight=None):
+        """
+        :param token_path: str, path to the serialized token. Defaults
+            to ~/.dbtoken
+        :param pool_size: int, number of connections kept in the pool.
+            Taken from the [RunDB] api_pool_size config field if not
+            specified.
+        :param max_in_flight: int, maximum number of requests running at
+            the same time. Taken from the [RunDB] api_max_in_flight config
+            field if not specified. 0 (or not set) means no limit other
+            than the pool_size, the same as for DB.
+        """
+        if aiohttp is None:
+            raise ImportError('AsyncDB requires aiohttp, install it with "pip install aiohttp"')
+        if token_path is None:
+            token_path = default_token_path()
+        if pool_size is None:
+            pool_size = (uconfig.getint('RunDB', 'api_pool_size', fallback=20)
+                         if uconfig is not None else 20)
+        if max_in_flight is None:
+            max_in_flight = max_in_flight_from_config()
+
+        self.token_path = token_path
+        self.pool_size = pool_size
+        # requests beyond the pool size would only wait for a connection
+        self.max_in_flight = max_in_flight or pool_size
+        self.token = None
+        self.headers = None
+        self.pushdown = (uconfig.getboolean('RunDB', 'api_pushdown', fallback=True)
+                         if uconfig is not None else True)
+        self.retry_policy = RetryPolicy.from_config()
+        self.circuit_breaker = CircuitBreaker.from_config()
+        # the number of requests in flight is capped by our own semaphore,
+        # only use the rate part of the limiter
+        self.rate_limiter = RateLimiter.from_config()
+
+        # These are bound to the running event loop, so only create them
+        # once we are called from within one.
+        self._session = None
+        self._semaphore = None
+        self._token_lock = None
+
+    async def __aenter__(self):
+        await self._ensure_ready()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Close the connection pool"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _ensure_ready(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._token_lock = asyncio.Lock()
+        if self.token is None or not self.token.is_valid:
+            await self._refresh_token()
+
+    async def _refresh_token(self):
+        async with self._token_lock:
+            # another task might have refreshed it while we were waiting
+            if self.token is not None and self.token.is_valid:
+                return
+            loop = asyncio.get_running_loop()
+            # The token logic does file IO and blocking API calls, keep it
+            # out of the event loop
+            if self.token is None:
+                self.token = await loop.run_in_executor(None, Token, self.token_path)
+            else:
+                await loop.run_in_executor(None, self.token.new_token)
+            headers = rundb.BASE_HEADERS.copy()
+            headers['Authorization'] = "Bearer {token}".format(token=self.token())
+            self.headers = headers
+
+    async def _request(self, method, url, data=None, read=None):
+        """
+        Do an API call and return the body of the response as bytes. GET
+        calls that fail with a transient error are retried, see DB.
+
+        :param read: coroutine function that is called with a successful
+            response instead of reading its body into memory, its result
+            is returned
+        """
+        await self._ensure_ready()
+        max_retries = self.retry_policy.max_retries if method == 'GET' else 0
+        attempt = 0
+        while True:
+            if not self.circuit_breaker.allow():
+                raise CircuitOpenError(
+                    f"Not calling {url}, the API failed too often recently", 503)
+            if self.rate_limiter is not None:
+                if self.rate_limiter.shared_file is None:
+                    wait = self.rate_limiter.reserve()
+                else:
+                    # the bucket is shared through a locked file, don't
+                    # block the event loop while waiting for the lock
+                    wait = await asyncio.get_running_loop().run_in_executor(
+                        None, self.rate_limiter.reserve)
+                await asyncio.sleep(wait)
+            try:
+                async with self._semaphore:
+                    async with self._session.request(method, rundb.PREFIX + url,
+                                                     data=data, headers=self.headers) as response:
+                        if read is not None and response.status == 200:
+                            body = await read(response)
+                        else:
+                            body = await response.read()
+            except aiohttp.ClientConnectionError:
+                self.circuit_breaker.record_failure()
+                if attempt >= max_retries:
+                    raise
+                delay = self.retry_policy.delay(attempt)
+            except (asyncio.CancelledError, KeyboardInterrupt, GeneratorExit):
+                # stopped by the caller (e.g. a timeout), not a failure of
+                # the API. If this was the trial call of the circuit
+                # breaker, the breaker lets another one through later.
+                raise
+            except BaseException:
+                # e.g. a broken payload
+                self.circuit_breaker.record_failure()
+                raise
+            else:
+                transient = response.status in self.retry_policy.retry_statuses
+                if transient:
+                    self.circuit_breaker.record_failure()
+                else:
+                    self.circuit_breaker.record_success()
+                if not transient or attempt >= max_retries:
+                    break
+                delay = self.retry_policy.delay(attempt, response.headers.get('Retry-After'))
+            logger.info(f'{url} failed, retrying in {delay:.1f} s')
+            attempt += 1
+            self.retry_policy.retries += 1
+            await asyncio.sleep(delay)
+
+        if response.status != 200:
+            check_status(url, response.status, body.decode(errors='replace'))
+        return body
+
+    async def _get(self, url):
+        return await self._request('GET', url)
+
+    async def _post(self, url, data):
+        return await self._request('POST', url, data=data)
+
+    @staticmethod
+    def _run_url(identifier, suffix='', base='/runs'):
+        # map from all kinds of types (int, np int, ...)
+        identifier = str(identifier)
+        if DB._is_run_number(identifier):
+            return '{base}/number/{num}{suffix}'.format(base=base, num=identifier, suffix=suffix)
+        return '{base}/name/{num}{suffix}'.format(base=base, num=identifier, suffix=suffix)
+
+    async def get_doc(self, identifier):
+        '''
+        Retrieves a document from the database. The identifier
+        could be a run number of run name - the disambiguation
+        takes place automatically.
+        '''
+        url = self._run_url(identifier)
+        return json_backend.loads(await self._get(url)).get('results', None)
+
+    async def get_docs(self, identifiers):
+        '''
+        Retrieves the documents of many runs concurrently, the number of
+        requests in flight is capped by max_in_flight.
+
+        :return: tuple of (list of documents in the order of identifiers,
+            dict of identifier -> exception for the runs that failed)
+        '''
+        identifiers = list(identifiers)
+        results = await asyncio.gather(*[self.get_doc(i) for i in identifiers],
+                                       return_exceptions=True)
+        errors = {}
+        for i, (identifier, result) in enumerate(zip(identifiers, results)):
+            if isinstance(result, Exception):
+                logger.warning(f'get_doc failed for {identifier}: {result}')
+                errors[identifier] = result
+                results[i] = None
+        return results, errors
+
+    async def get_data(self, identifier, projection=None, **filters):
+        '''
+        Retrieves the data portion of a document from the
+        database. The identifier could be a run number of
+        run name - the disambiguation takes place
+        automatically. See DB.get_data for the filters and projection.
+        '''
+        url = self._run_url(identifier, '/data')
+        query_string = data_query_string(filters, projection) if self.pushdown else ''
+        try:
+            body = await self._get(url + query_string)
+        except APIError as e:
+            # a bad request means the API does not understand the filters
+            if not query_string or e.status_code != 400:
+                raise
+            logger.warning('The API does not support filters on the data, '
+                           'filtering locally from now on')
+            self.pushdown = False
+            body = await self._get(url)
+        data = json_backend.loads(body).get('results', {})
+        if 'data' not in data:
+            raise RuntimeError('The requested document does not have a data key/value')
+        return filter_data(data['data'], filters, projection)
+
+    async def update_data(self, identifier, datum):
+        '''
+        Updates a data entry. Identifier can be run number of name.
+        '''
+        datum = json.dumps(cleanup_datadict(datum))
+        url = self._run_url(identifier, '/data/', base='/run')
+        return await self._post(url, data=datum)
+
+    async def query(self, page_num):
+        url = '/runs/page/{page_num}'.format(page_num=page_num)
+        return json_backend.loads(await self._get(url)).get('results', {})
+
+    async def query_by_source(self, source, page_num):
+        url = '/runs/source/{source}/page/{page_num}'.format(source=source, page_num=page_num)
+        return json_backend.loads(await self._get(url)).get('results', {})
+
+    async def query_by_tag(self, tag, page_num):
+        url = '/runs/tag/{tag}/page/{page_num}'.format(tag=tag, page_num=page_num)
+        return json_backend.loads(await self._get(url)).get('results', {})
+
+    async def iter_runs(self, source=None, tag=None, first_page=1, prefetch=True):
+        '''
+        Asynchronously iterate over all the run documents, optionally only
+        of one source or tag. The next page is requested while the current
+        one is being consumed. Stops at the first empty page.
+        '''
+        if source is not None and tag is not None:
+            raise ValueError('Can only query by source or by tag, not both')
+        if source is not None:
+            fetch = functools.partial(self.query_by_source, source)
+        elif tag is not None:
+            fetch = functools.partial(self.query_by_tag, tag)
+        else:
+            fetch = self.query
+
+        page_num = first_page
+        next_page = asyncio.ensure_future(fetch(page_num=page_num))
+        try:
+            while True:
+                page = await next_page
+                if not page:
+                    return
+                page_num += 1
+                if prefetch:
+                    next_page = asyncio.ensure_future(fetch(page_num=page_num))
+                for doc in page:
+                    yield doc
+                if not prefetch:
+                    next_page = asyncio.ensure_future(fetch(page_num=page_num))
+        finally:
+            # the consumer might stop early, don't leave the prefetch dangling
+            if not next_page.done():
+                next_page.cancel()
+
+    async def get_files(self, query: dict, projection=None):
+        """Do a general query on the fs.files collection"""
+        url = '/files/query'
+        # the projection needs to be a dict for the flask app
+        if projection is None:
+            projection = {}
+        data = json.dumps(dict(query=query, projection=projection))
+        return json_backend.loads(await self._post(url, data=data)).get('results', [])
+
+    async def get_file_md5(self, filename):
+        url = f"/files/{filename}/md5"
+        return json_backend.loads(await self._get(url))['results']
+
+    async def download_file(self, filename, save_dir='./', force=False, chunk_size=1024 * 1024,
+                            verify=True):
+        """
+        Downloads file from GridFS, see DB.download_file. The download goes
+        through the same retries, circuit breaker and rate limiter as the
+        other calls, and only one process downloads the same file at once.
+
+        :param verify: bool, check the md5 of the downloaded file, raises a
+            RuntimeError on a mismatch
+        """
+        url = f'/files/{filename}'
+        os.makedirs(save_dir, exist_ok=True)
+        write_to = os.path.join(save_dir, filename)
+        if os.path.exists(write_to) and not force:
+            logger.debug(f"{filename} already exists at {write_to} and the 'force' flag is not set.")
+            return write_to
+
+        md5 = await self.get_file_md5(filename) if verify else None
+        async with _target_lock(write_to):
+            if os.path.exists(write_to) and not force:
+                logger.debug(f"{filename} was downloaded to {write_to} by another process.")
+                return write_to
+            logger.debug(f"Downloading {filename} from gridfs...")
+            await self._download_to(url, write_to, chunk_size, md5)
+        logger.debug(f'DONE. {filename} downloaded to {write_to}')
+        return write_to
+
+    async def _download_to(self, url, write_to, chunk_size, md5=None):
+        """Stream url to a temporary file, which is moved to write_to once complete"""
+        loop = asyncio.get_running_loop()
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(write_to),
+                                         prefix=f'.{os.path.basename(write_to)}.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                async def read(response):
+                    hash_md5 = hashlib.md5()
+
+                    def write(chunk):
+                        f.write(chunk)
+                        hash_md5.update(chunk)
+
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        # writing to (network) disks can block for a while,
+                        # keep it out of the event loop
+                        await loop.run_in_executor(None, write, chunk)
+                    return hash_md5.hexdigest()
+
+                downloaded_md5 = await self._request('GET', url, read=read)
+            if md5 is not None and downloaded_md5 != md5:
+                raise RuntimeError(f'Downloaded {url} has md5 {downloaded_md5}, expected {md5}')
+            os.replace(temp_path, write_to)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+@contextlib.asynccontextmanager
+async def _target_lock(target):
+    """locking.target_lock, waiting for the lock in a thread"""
+    lock = target_lock(target)
+    acquire = asyncio.get_running_loop().run_in_executor(None, lock.__enter__)
+    try:
+        await asyncio.shield(acquire)
+    except asyncio.CancelledError:
+        # the thread still gets the lock, release it once it has
+        acquire.add_done_callback(
+            lambda future: future.exception() is None and lock.__exit__(None, None, None))
+        raise
+    try:
+        yield
+    finally:
+        lock.__exit__(None, None, None)
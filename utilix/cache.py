@@ -0,0 +1,186 @@
+"""
+Caches for the runDB API responses.
+
+ - ResponseCache: in-process TTL + LRU cache of GET responses keyed by url
+ - DocumentCache: on-disk cache of run documents, shared between processes
+"""
+
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from .locking import target_lock
+
+# Time to live (in seconds) of the cached responses. The first pattern
+# that matches the url wins, urls that do not match are never cached.
+DEFAULT_TTLS = (
+    (r'^/runs/(number|name)/', 60),
+    (r'^/contexts/', 3600),
+    (r'^/files/[^/]+/md5$', 300),
+)
+
+
+class ResponseCache:
+    """
+    Thread safe in-process cache of API responses with a time to live
+    per endpoint and least-recently-used eviction once either the maximum
+    number of entries or the byte budget is exceeded.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 ** 2, ttls=DEFAULT_TTLS):
+        """
+        :param max_entries: int, maximum number of cached responses
+        :param max_bytes: int, maximum total size of the cached responses
+        :param ttls: tuple of (url regex, time to live in seconds) pairs
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttls = tuple((re.compile(pattern), ttl) for pattern, ttl in ttls)
+
+        self._entries = OrderedDict()  # url -> (expires_at, nbytes, value)
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def ttl(self, url):
+        """Time to live for url, None if url should not be cached"""
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return None
+
+    def get(self, url):
+        """Get the cached value of url, None if it's not cached (or expired)"""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None and entry[0] < time.monotonic():
+                self._pop(url)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(url)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, url, value, nbytes):
+        """Cache value under url if there is a time to live for this url"""
+        ttl = self.ttl(url)
+        if ttl is None or nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if url in self._entries:
+                self._pop(url)
+            self._entries[url] = (time.monotonic() + ttl, nbytes, value)
+            self.nbytes += nbytes
+            while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, base):
+        """
+        Remove url base and all the urls below it (base/... or base?...)
+
+        :return: list, the values that were removed
+        """
+        base = base.rstrip('/')
+        with self._lock:
+            keys = [url for url in self._entries
+                    if url == base or url.startswith((base + '/', base + '?'))]
+            return [self._pop(url) for url in keys]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    @property
+    def stats(self):
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    evictions=self.evictions,
+                    entries=len(self._entries),
+                    nbytes=self.nbytes)
+
+    def _pop(self, url):
+        _, nbytes, value = self._entries.pop(url)
+        self.nbytes -= nbytes
+        return value
+
+
+class DocumentCache:
+    """
+    Cache of run documents on disk that many processes can read and write
+    at the same time. Every document is a json file that is written to a
+    temporary file and atomically renamed into place, so readers never see
+    a partial file. Fetching a missing document is done under a lock so
+    that only one process queries the API while the others wait for it.
+    The lock works without flock support too (see locking.target_lock) and
+    its file is removed again once the document is stored.
+    """
+
+    def __init__(self, folder, ttl=3600):
+        """
+        :param folder: str, folder to store the documents in
+        :param ttl: float, documents older than this (in seconds) are
+            fetched again
+        """
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.ttl = ttl
+
+    def _path(self, key):
+        return os.path.join(self.folder, re.sub(r'[^\w.-]', '_', key) + '.json')
+
+    def get(self, key):
+        """Get the document stored under key, None if missing or expired"""
+        path = self._path(key)
+        try:
+            if time.time() - os.stat(path).st_mtime > self.ttl:
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, doc):
+        fd, temp_path = tempfile.mkstemp(dir=self.folder, prefix='.tmp_')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(doc, f)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def get_or_fetch(self, key, fetch):
+        """
+        Get the document stored under key, or call fetch() to get it and
+        store it. Only one process at a time fetches the same key.
+        """
+        doc = self.get(key)
+        if doc is not None:
+            return doc
+        with target_lock(self._path(key), poll_interval=0.05):
+            # Another process might have fetched it while we were waiting
+            doc = self.get(key)
+            if doc is None:
+                doc = fetch()
+                if doc is not None:
+                    self.put(key, doc)
+        return doc
+
+    def invalidate(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,184 @@
+"""
+md5 hashing of (large) files.
+
+Files are read with a large reusable buffer (or memory mapped), and the
+hashes are remembered in a small sqlite database keyed by the path, size,
+modification time and inode of the file, so that a file that did not
+change is never hashed twice. hashlib releases the GIL while hashing, so
+md5_many hashes several files in parallel with threads.
+"""
+
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import uconfig, logger
+
+DEFAULT_BUFFER_SIZE = 8 * 1024 ** 2
+
+
+def default_buffer_size():
+    if uconfig is None:
+        return DEFAULT_BUFFER_SIZE
+    return uconfig.getint('RunDB', 'md5_buffer_size', fallback=DEFAULT_BUFFER_SIZE)
+
+
+def file_md5(path, buffer_size=None, use_mmap=False):
+    """
+    Compute the md5 of the file at path
+
+    :param path: str, path of the file
+    :param buffer_size: int, number of bytes to read at once. Taken from
+        the [RunDB] md5_buffer_size config field if not specified (8 MiB).
+    :param use_mmap: bool, memory map the file instead of reading it
+    :return: str, the md5 hash
+    """
+    if buffer_size is None:
+        buffer_size = default_buffer_size()
+    # Also, disable all the  Use of insecure MD2, MD4, MD5, or SHA1
+    # hash function violations in this function.
+    # bandit: disable=B303
+    hash_md5 = hashlib.md5()
+    with open(path, 'rb', buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        if use_mmap and size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    for start in range(0, size, buffer_size):
+                        hash_md5.update(view[start:start + buffer_size])
+        else:
+            # read into the same buffer over and over, no new bytes
+            # object for every chunk
+            buffer = bytearray(buffer_size)
+            with memoryview(buffer) as view:
+                for n in iter(lambda: f.readinto(buffer), 0):
+                    hash_md5.update(view[:n])
+    return hash_md5.hexdigest()
+
+
+class HashCache:
+    """
+    Persistent cache of the md5 of files. An entry is only used if the
+    size, modification time and inode of the file are still the same as
+    when it was hashed.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: str, the sqlite file to store the hashes in
+        """
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def _conn(self):
+        # sqlite connections can not be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS md5s ('
+                         'path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, '
+                         'inode INTEGER, md5 TEXT)')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _key(path):
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def get(self, path):
+        """The md5 of path if we hashed it before, else None"""
+        path, size, mtime, inode = self._key(path)
+        row = self._conn.execute(
+            'SELECT md5 FROM md5s WHERE path = ? AND size = ? AND mtime = ? AND inode = ?',
+            (path, size, mtime, inode)).fetchone()
+        return row[0] if row is not None else None
+
+    def md5(self, path, **kwargs):
+        """
+        Get the md5 of path from the cache, or compute (and store) it
+
+        :param kwargs: passed on to file_md5
+        """
+        try:
+            md5 = self.get(path)
+        except sqlite3.Error as e:
+            logger.debug(f'Cannot use the md5 cache {self.path}: {e}')
+            return file_md5(path, **kwargs)
+        if md5 is not None:
+            self.hits += 1
+            return md5
+        self.misses += 1
+        # stat before reading, if the file changes while we are hashing
+        # the entry will not match anymore
+        key = self._key(path)
+        md5 = file_md5(path, **kwargs)
+        try:
+            self._conn.execute('INSERT OR REPLACE INTO md5s VALUES (?, ?, ?, ?, ?)',
+                               key + (md5,))
+        except sqlite3.Error as e:
+            logger.debug(f'Cannot use the md5 cache {self.path}: {e}')
+        return md5
+
+    @property
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses)
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def default_hash_cache():
+    """
+    The HashCache at the [RunDB] md5_cache config field (default:
+    ~/.cache/utilix/md5.sqlite), None if that is set to an empty value
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            default = os.path.join(os.path.expanduser('~'), '.cache', 'utilix', 'md5.sqlite')
+            path = (uconfig.get('RunDB', 'md5_cache', fallback=default)
+                    if uconfig is not None else default)
+            if not path:
+                return None
+            try:
+                _default_cache = HashCache(path)
+            except OSError as e:
+                logger.debug(f'Cannot create the md5 cache at {path}: {e}')
+                return None
+        return _default_cache
+
+
+def md5(path, use_cache=True, **kwargs):
+    """
+    Get the md5 of the file at path, using the default hash cache
+
+    :param use_cache: bool, use (and fill) the default hash cache
+    :param kwargs: passed on to file_md5
+    """
+    cache = default_hash_cache() if use_cache else None
+    if cache is None:
+        return file_md5(path, **kwargs)
+    return cache.md5(path, **kwargs)
+
+
+def md5_many(paths, max_workers=4, use_cache=True, **kwargs):
+    """
+    Get the md5 of all paths, hashing max_workers files in parallel
+
+    :return: dict, path -> md5
+    """
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(paths, executor.map(
+            lambda path: md5(path, use_cache=use_cache, **kwargs), paths)))
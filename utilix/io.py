@@ -1,44 +1,101 @@
 import numpy as np
 import pickle
+import bz2
+import copy
 import gzip
 import json
+import lzma
+import mmap
+import re
+import struct
+import sys
+import threading
+import time
+import warnings
+import weakref
+import zipfile
+from collections import OrderedDict
+from collections.abc import Mapping
+from io import BufferedReader, BytesIO
 import pandas as pd
 import os
 import commentjson
 
+from . import uconfig, logger, json_backend
 
-def read_file(path):
+try:
+    import pyarrow
+    import pyarrow.csv
+except ImportError:
+    pyarrow = None
+
+try:
+    # decompresses gzip a lot faster than zlib, in a separate thread
+    from isal import igzip_threaded
+except ImportError:
+    igzip_threaded = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+_RUN_RANGE = re.compile(r'(\d+)\s*-\s*(\d+)')
+MMAP_ACCESS = {'r': mmap.ACCESS_READ, 'r+': mmap.ACCESS_WRITE, 'c': mmap.ACCESS_COPY}
+
+
+def read_file(path, mmap_mode=None, lazy=False):
     """
     Open a file from disk. Auto-infers the file format
-    :param path: str, file to open
+    :param path: str, file to open. It can be compressed with any of
+        COMPRESSIONS, e.g. map.npy.zst or table.csv.xz
+    :param mmap_mode: str, memory map .npy, .npz and .binary files instead
+        of reading them: 'r' (read only), 'r+' (changes are written to
+        the file) or 'c' (copy on write). Processes mapping the same file
+        share its pages in memory. .binary files are then returned as a
+        memoryview, and the arrays of an .npz file are only mapped if
+        they are stored without compression (np.savez, not
+        np.savez_compressed).
+    :param lazy: bool, return .npz files as a LazyNpz, which only reads
+        the arrays that are used and keeps the file open until all of
+        them are read or it is closed. By default all arrays are read
+        into a dict right away.
     :return: opened file
     """
+    if mmap_mode is not None and mmap_mode not in MMAP_ACCESS:
+        raise ValueError(f'mmap_mode should be one of {list(MMAP_ACCESS)}, got {mmap_mode}')
     # copied from straxen.common.open_resource
     # https://github.com/XENONnT/straxen/blob/a2e0e3abdbf278000cda70f7662a7d841c7223ef/straxen/common.py#L85
     name, fmt = os.path.splitext(path)
 
-    if fmt in ['.npy', '.npy_pickle', '.npz']:
-        result = np.load(path, allow_pickle=fmt == 'npy_pickle')
-        if isinstance(result, np.lib.npyio.NpzFile):
+    if fmt in COMPRESSIONS:
+        result = _read_compressed(path, os.path.splitext(name)[1])
+    elif fmt == '.npz':
+        result = LazyNpz(path, mmap_mode=mmap_mode)
+        if not lazy:
             # Slurp the arrays in the file, so the result can be copied,
             # then close the file so its descriptors does not leak.
-            result_slurped = {k: v[:] for k, v in result.items()}
-            result.close()
-            result = result_slurped
+            with result:
+                result = dict(result)
+    elif fmt == '.npy' and mmap_mode is not None:
+        result = np.load(path, mmap_mode=mmap_mode)
+    elif fmt in ['.npy', '.npy_pickle']:
+        result = np.load(path, allow_pickle=fmt == '.npy_pickle')
     elif fmt == '.pkl':
         with open(path, 'rb') as f:
             result = pickle.load(f)
-    elif fmt == '.gz':
-        subname, subfmt = os.path.splitext(name)
-        if subfmt == '.pkl':
-            with gzip.open(path, 'rb') as f:
-                result = pickle.load(f)
-        elif subfmt == '.json':
-            with gzip.open(path, 'rb') as f:
-                result = json.load(f)
+    elif fmt == '.jsonl':
+        result = list(iter_jsonl(path))
     elif fmt == '.json':
         with open(path, mode='r') as f:
             result = commentjson.load(f)
+    elif fmt == '.binary' and mmap_mode is not None:
+        result = _map_binary(path, mmap_mode)
     elif fmt == '.binary':
         with open(path, mode='rb') as f:
             result = f.read()
@@ -53,14 +110,584 @@ def read_file(path):
     return result
 
 
+def _map_binary(path, mmap_mode):
+    """Memory map the file at path, returns a memoryview of its bytes"""
+    with open(path, mode='rb' if mmap_mode == 'r' else 'r+b') as f:
+        if not os.fstat(f.fileno()).st_size:
+            # empty files cannot be mapped
+            return memoryview(b'')
+        # the map stays valid after closing the file
+        return memoryview(mmap.mmap(f.fileno(), 0, access=MMAP_ACCESS[mmap_mode]))
+
+
+def _open_gzip(path):
+    if igzip_threaded is not None:
+        return igzip_threaded.open(path, 'rb', threads=1)
+    return gzip.open(path, 'rb')
+
+
+def _open_zstd(path):
+    if zstandard is None:
+        raise ImportError(f'Reading {path} requires zstandard, install it with '
+                          f'"pip install zstandard"')
+    # the zstandard reader can not read lines, buffer it
+    return BufferedReader(zstandard.open(path, 'rb'), buffer_size=1024 ** 2)
+
+
+def _open_lz4(path):
+    if lz4 is None:
+        raise ImportError(f'Reading {path} requires lz4, install it with "pip install lz4"')
+    return lz4.frame.open(path, 'rb')
+
+
+# Compressions that can wrap any of the formats of read_file (e.g.
+# map.npy.zst), with the function to open such a file for reading the
+# decompressed bytes.
+COMPRESSIONS = {
+    '.gz': _open_gzip,
+    '.bz2': lambda path: bz2.open(path, 'rb'),
+    '.xz': lambda path: lzma.open(path, 'rb'),
+    '.zst': _open_zstd,
+    '.lz4': _open_lz4,
+}
+
+
+def open_decompressed(path):
+    """
+    Open path for reading bytes. Compressed files (see COMPRESSIONS) are
+    decompressed while they are being read.
+    """
+    _, compression = os.path.splitext(path)
+    if compression in COMPRESSIONS:
+        return COMPRESSIONS[compression](path)
+    return open(path, 'rb')
+
+
+def _read_compressed(path, fmt):
+    """
+    Read the compressed file at path, fmt is the format of its content
+    (the suffix before the compression suffix)
+    """
+    with open_decompressed(path) as f:
+        if fmt in ['.npy', '.npy_pickle']:
+            # np.load wants to seek, read_array does not. Hide that there
+            # is a file descriptor, numpy would read the compressed bytes.
+            return np.lib.format.read_array(_Stream(f), allow_pickle=fmt == '.npy_pickle')
+        if fmt == '.npz':
+            # zip files need random access
+            with np.load(BytesIO(f.read())) as npz:
+                return {key: npz[key] for key in npz.files}
+        if fmt == '.pkl':
+            return pickle.load(f)
+        if fmt == '.json':
+            return json.load(f)
+        if fmt == '.jsonl':
+            return list(_jsonl_records(f, columns=None))
+        if fmt == '.binary':
+            return f.read()
+        if fmt in ['.text', '.txt']:
+            return f.read().decode()
+        if fmt == '.csv':
+            return pd.read_csv(f)
+    raise ValueError(f"Unsupported format {fmt}!")
+
+
+class _Stream:
+    """Only the read methods of a file object"""
+
+    def __init__(self, f):
+        self.read = f.read
+        self.readline = f.readline
+
+
+def iter_csv(path, chunksize=100_000, columns=None, dtype=None, engine='pandas'):
+    """
+    Read a (possibly compressed) csv file in chunks, so that only one
+    chunk at a time is in memory
+
+    :param path: str, the csv file
+    :param chunksize: int, number of rows per chunk
+    :param columns: list, only read these columns
+    :param dtype: dtype or dict of column -> dtype. Giving the dtypes
+        saves pandas from guessing them for every chunk, and makes sure
+        all chunks have the same dtypes.
+    :param engine: str, 'pandas', 'pyarrow' (faster columnar parser, the
+        chunks are then blocks of about chunksize rows) or 'auto'. pyarrow
+        guesses the type of a column from the first block only, and fails
+        on a later value that does not fit (e.g. 1.5 in a column of
+        integers). 'auto' therefore only uses pyarrow if it is installed
+        and the columns are given with a dtype for every one of them.
+    :return: generator of pandas.DataFrame
+    """
+    if engine == 'auto':
+        typed = columns is not None and (
+            dtype is not None and (not isinstance(dtype, dict)
+                                   or all(column in dtype for column in columns)))
+        engine = 'pyarrow' if pyarrow is not None and typed else 'pandas'
+    if engine == 'pyarrow':
+        yield from _iter_csv_pyarrow(path, chunksize, columns, dtype)
+        return
+    if engine != 'pandas':
+        raise ValueError(f'Unknown engine {engine}')
+    with open_decompressed(path) as f, \
+            pd.read_csv(f, chunksize=chunksize, usecols=columns, dtype=dtype) as reader:
+        yield from reader
+
+
+def _iter_csv_pyarrow(path, chunksize, columns, dtype):
+    if pyarrow is None:
+        raise ImportError('The pyarrow engine requires pyarrow, install it with '
+                          '"pip install pyarrow"')
+    if dtype is not None and not isinstance(dtype, dict):
+        if columns is None:
+            raise ValueError('Give the columns to use a single dtype with pyarrow')
+        dtype = {column: dtype for column in columns}
+    column_types = {column: pyarrow.from_numpy_dtype(np.dtype(column_dtype))
+                    for column, column_dtype in (dtype or {}).items()}
+    # pyarrow reads blocks of bytes, estimate how many we need for
+    # chunksize rows from the first line
+    with open_decompressed(path) as f:
+        f.readline()
+        row_bytes = max(len(f.readline()), 1)
+    convert_options = pyarrow.csv.ConvertOptions(column_types=column_types)
+    if columns is not None:
+        convert_options.include_columns = list(columns)
+    with open_decompressed(path) as f:
+        reader = pyarrow.csv.open_csv(
+            f,
+            read_options=pyarrow.csv.ReadOptions(block_size=max(row_bytes * chunksize, 1 << 16)),
+            convert_options=convert_options)
+        for batch in reader:
+            yield batch.to_pandas()
+
+
+def iter_jsonl(path, columns=None, chunksize=None, dtype=None):
+    """
+    Read a (possibly compressed) json lines file record by record, so
+    that only one record (or chunk) at a time is in memory
+
+    :param path: str, the json lines file
+    :param columns: list, only keep these keys of every record
+    :param chunksize: int, yield DataFrames of this many records instead
+        of the records themselves
+    :param dtype: dtype or dict of column -> dtype for the DataFrames
+    :return: generator of dicts, or of pandas.DataFrame if chunksize is set
+    """
+    with open_decompressed(path) as f:
+        records = _jsonl_records(f, columns)
+        if chunksize is None:
+            yield from records
+            return
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) == chunksize:
+                yield _records_to_frame(chunk, columns, dtype)
+                chunk = []
+        if chunk:
+            yield _records_to_frame(chunk, columns, dtype)
+
+
+def _jsonl_records(f, columns):
+    for line in f:
+        if not line.strip():
+            continue
+        record = json_backend.loads(line)
+        if columns is not None:
+            record = {column: record.get(column) for column in columns}
+        yield record
+
+
+def _records_to_frame(records, columns, dtype):
+    frame = pd.DataFrame.from_records(records, columns=columns)
+    if dtype is not None:
+        frame = frame.astype(dtype)
+    return frame
+
+
+class LazyNpz(Mapping):
+    """
+    Read only dict of the arrays in an .npz file. An array is only read
+    from the file when it is first accessed, and kept for later use. The
+    file is closed once all arrays are read, on close() (or leaving a
+    with block), or when the LazyNpz is garbage collected.
+
+    Copying or pickling it gives a plain dict with all the arrays.
+    """
+
+    def __init__(self, path, mmap_mode=None):
+        """
+        :param path: str, the .npz file
+        :param mmap_mode: str, memory map the arrays that are stored
+            without compression, see read_file
+        """
+        self.path = path
+        self.mmap_mode = mmap_mode
+        self._zip = zipfile.ZipFile(path)
+        self._file = open(path, 'rb') if mmap_mode is not None else None
+        self._members = {(info.filename[:-len('.npy')] if info.filename.endswith('.npy')
+                          else info.filename): info
+                         for info in self._zip.infolist()}
+        self._arrays = {}
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, _close_all, self._zip, self._file)
+
+    def __getitem__(self, key):
+        if key in self._arrays:
+            return self._arrays[key]
+        info = self._members[key]
+        with self._lock:
+            if key not in self._arrays:
+                if not self._finalizer.alive:
+                    raise ValueError(f'{self.path} is closed')
+                start = time.perf_counter()
+                self._arrays[key] = self._load(info)
+                logger.debug(f'Loaded {key} from {self.path} in '
+                             f'{(time.perf_counter() - start) * 1e3:.1f} ms')
+                if len(self._arrays) == len(self._members):
+                    # nothing left to read
+                    self.close()
+        return self._arrays[key]
+
+    def _load(self, info):
+        if self.mmap_mode is not None and info.compress_type == zipfile.ZIP_STORED:
+            array = _map_npz_member(self.path, self._file, info, self.mmap_mode)
+            if array is not None:
+                return array
+        with self._zip.open(info) as member:
+            return np.lib.format.read_array(member, allow_pickle=False)
+
+    def __iter__(self):
+        return iter(self._members)
+
+    def __len__(self):
+        return len(self._members)
+
+    def __contains__(self, key):
+        return key in self._members
+
+    def __repr__(self):
+        return (f'LazyNpz({self.path!r}, {len(self._arrays)}/{len(self._members)} '
+                f'arrays loaded)')
+
+    def close(self):
+        """Close the file, arrays that were loaded stay available"""
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return {key: np.copy(array) for key, array in self.items()}
+
+    def __reduce__(self):
+        return dict, (list(self.items()),)
+
+
+def _close_all(*files):
+    for f in files:
+        if f is not None:
+            f.close()
+
+
+def _map_npz_member(path, f, info, mmap_mode):
+    """
+    Map the array of the (uncompressed) zip member info, None if it cannot
+    be mapped (e.g. an object array)
+    """
+    # The data follows the local file header, which has a fixed size of
+    # 30 bytes plus the file name and an extra field of variable size
+    f.seek(info.header_offset)
+    header = f.read(30)
+    if len(header) != 30 or header[:4] != b'PK\x03\x04':
+        return None
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    f.seek(info.header_offset + 30 + name_length + extra_length)
+
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    elif version == (2, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    else:
+        return None
+    if dtype.hasobject or not np.prod(shape, dtype=np.int64):
+        # object arrays need unpickling, empty arrays cannot be mapped
+        return None
+    return np.memmap(path, dtype=dtype, mode=mmap_mode, offset=f.tell(), shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+class MemoizedReader:
+    """
+    Thread safe in-process cache of read_file results. Files are keyed by
+    their path, modification time, size and inode (or a key given by the
+    caller, such as the md5 of the file in GridFS), so a changed file is
+    read again. The least recently used results are dropped once the
+    memory budget is exceeded.
+
+    The numpy arrays in the cached results are shared between all
+    callers and made read only, use np.copy to get an array that can be
+    changed. Every caller gets its own copy of the dicts, lists and
+    DataFrames. Lazily read .npz files (lazy=True) are not cached, they
+    would be closed for everyone by the first caller that closes them.
+    """
+
+    def __init__(self, max_bytes=1024 ** 3):
+        """
+        :param max_bytes: int, memory budget for the cached results,
+            results larger than this are not cached
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (nbytes, result)
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def read_file(self, path, key=None, **kwargs):
+        """
+        read_file(path, **kwargs), or the result of an earlier call for
+        the same (unchanged) file
+
+        :param key: str, identifies the content of the file, e.g. its md5.
+            Defaults to its path, modification time, size and inode.
+        :param kwargs: passed on to read_file
+        """
+        if kwargs.get('lazy'):
+            return read_file(path, **kwargs)
+        if key is None:
+            stat = os.stat(path)
+            key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        key = (key, tuple(sorted(kwargs.items())))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _copy_result(entry[1])
+            self.misses += 1
+
+        # Read outside of the lock, the same file might be read twice at
+        # the same time but other files do not have to wait for it.
+        result = read_file(path, **kwargs)
+        nbytes = _nbytes(result, path)
+        if nbytes > self.max_bytes:
+            return result
+        result = _make_readonly(result)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (nbytes, result)
+                self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (evicted_nbytes, _) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+                self.evictions += 1
+        return _copy_result(result)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    @property
+    def stats(self):
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    evictions=self.evictions,
+                    entries=len(self._entries),
+                    nbytes=self.nbytes)
+
+
+def _make_readonly(result):
+    """Make the numpy arrays in result read only"""
+    if isinstance(result, np.ndarray):
+        result.flags.writeable = False
+    elif isinstance(result, dict):
+        for value in result.values():
+            _make_readonly(value)
+    elif isinstance(result, (list, tuple)):
+        for value in result:
+            _make_readonly(value)
+    return result
+
+
+def _copy_result(result):
+    """
+    Copy of a cached result for a caller, the (read only) numpy arrays
+    and immutable values are shared
+    """
+    if isinstance(result, (np.ndarray, memoryview, bytes, str, int, float, bool, type(None))):
+        return result
+    if isinstance(result, pd.DataFrame):
+        return result.copy()
+    if type(result) is dict:
+        return {key: _copy_result(value) for key, value in result.items()}
+    if type(result) is list:
+        return [_copy_result(value) for value in result]
+    if type(result) is tuple:
+        return tuple(_copy_result(value) for value in result)
+    return copy.deepcopy(result)
+
+
+def _nbytes(result, path):
+    """Estimate the memory used by result, read from the file at path"""
+    if isinstance(result, np.memmap):
+        # the pages are in the page cache, shared with other processes
+        return 0
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if isinstance(result, (bytes, str, memoryview)):
+        return len(result)
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(deep=True).sum())
+    if isinstance(result, dict):
+        return sum(_nbytes(value, path) for value in result.values())
+    if isinstance(result, (list, tuple)):
+        return sum(_nbytes(value, path) for value in result)
+    return sys.getsizeof(result)
+
+
+_memoized_reader = None
+_memoized_reader_lock = threading.Lock()
+
+
+def memoized_reader():
+    """
+    The MemoizedReader used by read_file_cached, with the budget taken
+    from the [RunDB] load_cache_max_bytes config field (default 1 GiB)
+    """
+    global _memoized_reader
+    with _memoized_reader_lock:
+        if _memoized_reader is None:
+            max_bytes = (uconfig.getint('RunDB', 'load_cache_max_bytes', fallback=1024 ** 3)
+                         if uconfig is not None else 1024 ** 3)
+            _memoized_reader = MemoizedReader(max_bytes=max_bytes)
+        return _memoized_reader
+
+
+def read_file_cached(path, key=None, **kwargs):
+    """
+    Like read_file, but the result is reused for later calls with the same
+    (unchanged) file, see MemoizedReader. Numpy arrays in the result are
+    read only, everything else is a copy.
+    """
+    return memoized_reader().read_file(path, key=key, **kwargs)
+
+
 def load_runlist(runlist_path):
+    """
+    Load a list of run numbers from an .npy, .pkl, .txt or .text file
+    (possibly compressed, see COMPRESSIONS). Text files have run numbers
+    separated by whitespace or commas, ranges such as 1000-2000
+    (inclusive) and comments starting with #.
+
+    :param runlist_path: str, the file
+    :return: np.ndarray of int64, the sorted unique run numbers
+    """
     name, fmt = os.path.splitext(runlist_path)
+    if fmt in COMPRESSIONS:
+        fmt = os.path.splitext(name)[1]
     if fmt in ['.npy', '.pkl']:
-        return read_file(runlist_path)
-    elif fmt in ['.txt', 'text']:
-        ret = []
-        with open(runlist_path) as f:
-            for line in f.readlines():
-                ret.append(int(line.rstrip()))
-        return ret
+        runs = np.asarray(read_file(runlist_path), dtype=np.int64).ravel()
+    elif fmt in ['.txt', '.text']:
+        runs = parse_runlist(read_file(runlist_path))
+    else:
+        raise ValueError(f"Unsupported run list format {fmt}!")
+    return _as_runlist(runs)
+
+
+def parse_runlist(text):
+    """
+    Parse the run numbers in text, see load_runlist
+
+    :return: np.ndarray of int64, the sorted unique run numbers
+    """
+    if '#' in text:
+        text = re.sub(r'#[^\n]*', ' ', text)
+    runs = []
+    if '-' in text:
+        bounds = np.array(_RUN_RANGE.findall(text), dtype=np.int64).reshape(-1, 2)
+        text = _RUN_RANGE.sub(' ', text)
+        starts, lengths = bounds[:, 0], bounds[:, 1] - bounds[:, 0] + 1
+        if (lengths <= 0).any():
+            raise ValueError(f'Empty run range in {bounds[lengths <= 0].tolist()}')
+        # all the numbers of all ranges at once: an arange per range,
+        # shifted to the start of its range
+        first_index = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        runs.append(np.arange(lengths.sum()) - first_index + np.repeat(starts, lengths))
+    text = text.replace(',', ' ')
+    if text.strip():
+        # numpy parses the numbers in C, a lot faster than int() per line
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            try:
+                runs.append(np.fromstring(text, dtype=np.int64, sep=' '))
+            except (ValueError, DeprecationWarning) as e:
+                raise ValueError(f'Cannot parse the run list: {e}') from e
+    if not runs:
+        return np.zeros(0, dtype=np.int64)
+    return _sorted_unique(np.concatenate(runs))
+
 
+def _as_runlist(runlist):
+    """runlist as a sorted unique int64 array, without sorting if it already is"""
+    runlist = np.asarray(runlist, dtype=np.int64).ravel()
+    if (runlist[1:] > runlist[:-1]).all():
+        return runlist
+    return _sorted_unique(runlist)
+
+
+def _sorted_unique(runs):
+    # np.unique, but np.unique hashes the values before sorting them,
+    # which is a lot slower for our large run lists
+    runs = np.sort(runs)
+    return runs[np.concatenate(([True], runs[1:] != runs[:-1]))[:len(runs)]]
+
+
+def runlist_union(*runlists):
+    """Sorted unique run numbers that are in any of the run lists"""
+    if not runlists:
+        return np.zeros(0, dtype=np.int64)
+    runs = np.concatenate([_as_runlist(runlist) for runlist in runlists])
+    # merging sorted runs is about linear for timsort
+    runs.sort(kind='stable')
+    return runs[np.concatenate(([True], runs[1:] != runs[:-1]))[:len(runs)]]
+
+
+def runlist_intersection(runlist, *others):
+    """Sorted unique run numbers that are in all of the run lists"""
+    result = _as_runlist(runlist)
+    for other in others:
+        result = result[isin_runlist(result, other)]
+    return result
+
+
+def runlist_difference(runlist, *others):
+    """Sorted unique run numbers of runlist that are in none of the others"""
+    result = _as_runlist(runlist)
+    for other in others:
+        result = result[~isin_runlist(result, other)]
+    return result
+
+
+def isin_runlist(runs, runlist):
+    """
+    Which of runs are in runlist
+
+    :param runs: int or array of run numbers
+    :param runlist: array of run numbers, e.g. from load_runlist
+    :return: bool or array of bools
+    """
+    result = np.isin(runs, np.asarray(runlist, dtype=np.int64))
+    return result if np.ndim(runs) else bool(result)
@@ -0,0 +1,54 @@
+"""
+Pluggable json decoding of the API responses.
+
+The responses are parsed straight from the raw bytes, using orjson if it
+is installed and the standard library otherwise. The backend can be
+chosen with the [RunDB] json_backend config field or set_backend.
+"""
+
+import json
+
+from . import uconfig
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _orjson_loads(content):
+    try:
+        return orjson.loads(content)
+    except orjson.JSONDecodeError:
+        # orjson is strict, e.g. it refuses the NaN that python's json
+        # (and thus the API) writes, so give the stdlib a go as well
+        return json.loads(content)
+
+
+BACKENDS = {'json': json.loads}
+if orjson is not None:
+    BACKENDS['orjson'] = _orjson_loads
+
+_loads = None
+
+
+def set_backend(name='auto'):
+    """
+    Set the json decoder used for the API responses
+
+    :param name: str, one of BACKENDS or 'auto' for the fastest installed
+    """
+    global _loads
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in BACKENDS else 'json'
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown json backend {name}, choose from {list(BACKENDS)}')
+    _loads = BACKENDS[name]
+
+
+def loads(content):
+    """Decode the json in content (bytes or str)"""
+    return _loads(content)
+
+
+set_backend(uconfig.get('RunDB', 'json_backend', fallback='auto') if uconfig is not None else 'auto')
@@ -0,0 +1,206 @@
+"""
+File locks to coordinate processes on the same node (e.g. the array jobs
+of a batch submission) that share a cache folder.
+"""
+
+import errno
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from . import logger
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, there is no cross-process locking there
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path, shared=False):
+    """
+    Hold an exclusive (or shared) lock on the file at path. Blocks until
+    the lock is acquired. The lock is released by the kernel if the
+    holding process dies.
+
+    :param path: str, path of the lock file, created if needed
+    :param shared: bool, take a shared lock instead of an exclusive one
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield fd
+    finally:
+        # closing the descriptor also releases the lock
+        os.close(fd)
+
+
+class LockTimeout(Exception):
+    """Raised if a lock could not be acquired in time"""
+    pass
+
+
+@contextmanager
+def target_lock(target, timeout=None, stale_after=60, poll_interval=0.2):
+    """
+    Exclusive lock for creating the file target, so that only one process
+    (or thread) writes it while the others wait. The lock file is
+    target + '.lock', it is removed again when the lock is released.
+
+    An flock is used where the file system supports it, it is released by
+    the kernel if the holder dies. Otherwise (e.g. Lustre without flock)
+    the lock is a file created with O_EXCL holding the pid, host and time
+    of the holder, which is touched every few seconds while held. Such a
+    lock is taken over if its holder died (same host) or it was not
+    touched for stale_after seconds.
+
+    :param target: str, path of the file to lock
+    :param timeout: float, seconds to wait for the lock, None for no limit
+    :param stale_after: float, seconds after which an untouched lock file
+        is considered stale
+    :param poll_interval: float, seconds between attempts to get the lock
+    """
+    path = target + '.lock'
+    deadline = None if timeout is None else time.monotonic() + timeout
+    fd = _flock(path, deadline, poll_interval) if fcntl is not None else None
+    if fd is not None:
+        try:
+            yield
+        finally:
+            # remove the file while we still hold the lock, processes
+            # waiting for it notice that it is gone (see _flock)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+        return
+
+    _create_lock_file(path, deadline, stale_after, poll_interval)
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_touch_lock_file,
+                                 args=(path, stop, stale_after / 4),
+                                 daemon=True)
+    heartbeat.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        heartbeat.join()
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _flock(path, deadline, poll_interval):
+    """Get an flock on path, None if the file system does not support it"""
+    fd, created = _open_lock_file(path)
+    try:
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    # locks are not supported here. Remove the file if we
+                    # created it, the fallback creates it with O_EXCL.
+                    if created and _same_file(fd, path):
+                        os.remove(path)
+                    os.close(fd)
+                    return None
+            else:
+                if _same_file(fd, path):
+                    return fd
+                # the previous holder removed the file we locked, try
+                # again with the current one
+                os.close(fd)
+                fd, created = _open_lock_file(path)
+                continue
+            if deadline is not None and time.monotonic() > deadline:
+                raise LockTimeout(f'Could not get the lock {path}')
+            time.sleep(poll_interval)
+    except BaseException:
+        os.close(fd)
+        raise
+
+
+def _open_lock_file(path):
+    """Open (or create) the lock file at path, returns (fd, created)"""
+    while True:
+        try:
+            return os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o666), True
+        except FileExistsError:
+            pass
+        try:
+            return os.open(path, os.O_RDWR), False
+        except FileNotFoundError:
+            # removed in the meantime, create it
+            continue
+
+
+def _same_file(fd, path):
+    """Is the file open at fd still the one at path"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    fd_stat = os.fstat(fd)
+    return (stat.st_dev, stat.st_ino) == (fd_stat.st_dev, fd_stat.st_ino)
+
+
+def _create_lock_file(path, deadline, stale_after, poll_interval):
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        except FileExistsError:
+            if _is_stale(path, stale_after):
+                logger.warning(f'Removing the stale lock {path}')
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+        else:
+            with os.fdopen(fd, 'w') as f:
+                f.write(f'{os.getpid()} {socket.gethostname()} {time.time()}')
+            return
+        if deadline is not None and time.monotonic() > deadline:
+            raise LockTimeout(f'Could not get the lock {path}')
+        time.sleep(poll_interval)
+
+
+def _is_stale(path, stale_after):
+    """Did the holder of the lock file at path die or stop touching it"""
+    try:
+        with open(path) as f:
+            pid, host, _ = f.read().split()
+        if host == socket.gethostname():
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                # the process exists, it's just not ours
+                pass
+        return time.time() - os.path.getmtime(path) > stale_after
+    except FileNotFoundError:
+        # released in the meantime
+        return False
+    except ValueError:
+        # garbled, or the holder did not finish writing it yet
+        try:
+            return time.time() - os.path.getmtime(path) > stale_after
+        except FileNotFoundError:
+            return False
+
+
+def _touch_lock_file(path, stop, interval):
+    while not stop.wait(interval):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
@@ -17,19 +17,24 @@ This module contains 5 classes:
 
 import os
 import tempfile
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from warnings import warn
 import gridfs
 from tqdm import tqdm
-from shutil import move
 import hashlib
 from pymongo.collection import Collection as pymongo_collection
+from pymongo.errors import PyMongoError
 import typing as ty
 import numpy as np
 import pandas as pd
 
-from . import uconfig, logger
-from .rundb import xent_collection, DB
+from . import uconfig, logger, hashing
+from .rundb import xent_collection, DB, APIError
+from .resource_cache import ResourceCache
+from .locking import target_lock
 
 
 class GridFsBase:
@@ -69,6 +74,50 @@ class GridFsBase:
     def md5_stored(self, abs_path):
         raise NotImplementedError
 
+    def find_files(self, query, projection):
+        """Get the documents in fs.files matching the query"""
+        raise NotImplementedError
+
+    def configs_exist(self, configs):
+        """
+        Batched version of config_exists, in a single query
+
+        :param configs: iterable of the names of the files of interest
+        :return: set, the names that are stored in the database
+        """
+        docs = self.find_files({self.config_identifier: {'$in': list(configs)}},
+                               {self.config_identifier: 1, '_id': 0})
+        return {doc[self.config_identifier] for doc in docs}
+
+    def md5s_stored(self, md5s):
+        """
+        Batched version of md5_stored for precomputed md5s, in a single
+        query
+
+        :param md5s: iterable of md5 hashes
+        :return: set, the md5s that are stored in the database
+        """
+        docs = self.find_files({'md5': {'$in': list(md5s)}}, {'md5': 1, '_id': 0})
+        return {doc['md5'] for doc in docs}
+
+    def stored_files(self, configs_and_md5s):
+        """
+        Check which of the (config name, md5) pairs are stored in the
+        database, in a single query.
+
+        :param configs_and_md5s: iterable of (config name, md5) tuples
+        :return: set, the (config name, md5) tuples that are stored
+        """
+        configs_and_md5s = list(configs_and_md5s)
+        if not configs_and_md5s:
+            return set()
+        configs, md5s = zip(*configs_and_md5s)
+        docs = self.find_files({self.config_identifier: {'$in': list(set(configs))},
+                                'md5': {'$in': list(set(md5s))}},
+                               {self.config_identifier: 1, 'md5': 1, '_id': 0})
+        stored = {(doc.get(self.config_identifier), doc.get('md5')) for doc in docs}
+        return stored.intersection(configs_and_md5s)
+
     def test_find(self):
         raise NotImplementedError
 
@@ -76,28 +125,20 @@ class GridFsBase:
         raise NotImplementedError
 
     @staticmethod
-    def compute_md5(abs_path):
+    def compute_md5(abs_path, use_cache=True):
         """
-        NB: RAM intensive operation!
-        Get the md5 hash of a file stored under abs_path
+        Get the md5 hash of a file stored under abs_path. The file is
+        read in large chunks (see utilix.hashing), and the hash is
+        remembered so that an unchanged file is not hashed again.
 
         :param abs_path: str, absolute path to a file
+        :param use_cache: bool, use the persistent hash cache
         :return: str, the md5-hash of the requested file
         """
-        # This function is copied from:
-        # stackoverflow.com/questions/3431825/generating-an-md5-checksum-of-a-file
-
         if not os.path.exists(abs_path):
             # if there is no file, there is nothing to compute
             return ""
-        # Also, disable all the  Use of insecure MD2, MD4, MD5, or SHA1
-        # hash function violations in this function.
-        # bandit: disable=B303
-        hash_md5 = hashlib.md5()
-        with open(abs_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        return hashing.md5(abs_path, use_cache=use_cache)
 
 
 class GridFsUploadBase:
@@ -106,14 +147,69 @@ class GridFsUploadBase:
     def upload_single(self, config, abs_path):
         raise NotImplementedError
 
-    def upload_from_dict(self, file_path_dict):
-        raise NotImplementedError
+    def upload_from_dict(self, file_path_dict, max_workers=4):
+        """
+        Upload all files in the dictionary to the database, using a pool
+        of max_workers threads.
+
+        :param file_path_dict: dict, dictionary of paths to upload. The
+            dict should be of the format:
+            file_path_dict = {'config_name':  '/the_config_path', ...}
+        :param max_workers: int, number of files to handle at once
+
+        A file is only skipped if a file with the same md5 is stored under
+        the same name, not if the name and the md5 are each stored with
+        another file. A failing upload (see TRANSFER_ERRORS) does not stop
+        the others.
+
+        :return: dict, for every config_name either 'uploaded',
+            'skipped' (the same file is already stored) or the exception
+            that made the upload fail
+        """
+        if not isinstance(file_path_dict, dict):
+            raise ValueError(f'file_path_dict must be dict of form '
+                             f'"dict(NAME=ABSOLUTE_PATH,...)". Got '
+                             f'{type(file_path_dict)} instead')
+
+        # We need to do this expensive check here. It is not enough
+        # to just check that the file is stored under the
+        # 'config_identifier'. What if the file changed? Then we
+        # want to upload a new file! If it turns out we have the
+        # exact same file under the same name, forget about uploading
+        # it. All the files are checked with a single query.
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            md5s = dict(zip(file_path_dict,
+                            executor.map(self.compute_md5, file_path_dict.values())))
+        stored = self.stored_files(md5s.items())
+
+        def upload(config, abs_path):
+            self.upload_single(config, abs_path)
+            return 'uploaded'
+
+        # This means we are going to upload the files because they are
+        # not stored yet.
+        uploaded = run_concurrently(
+            upload,
+            [(config, abs_path) for config, abs_path in file_path_dict.items()
+             if (config, md5s[config]) not in stored],
+            max_workers, 'uploading')
+        return {config: uploaded.get(config, 'skipped') for config in file_path_dict}
 
 
 class GridFsDownloadBase:
     """Base class for downloads"""
 
-    def __init__(self, store_files_at=None):
+    def __init__(self, store_files_at=None, cache_quota=None, cache_policy=None):
+        """
+        :param store_files_at: tuple of folders to look for the files in,
+            new files are stored in the first one we can write to
+        :param cache_quota: int or str, maximum total size of the files
+            in that folder (e.g. 50G). Taken from the [RunDB]
+            resource_cache_quota config field if not specified, no limit
+            if that is not set either.
+        :param cache_policy: str, evict the least recently ('lru') or
+            least frequently ('lfu') used files first
+        """
         # We are going to set a place where to store the files. It's
         # either specified by the user or we use these defaults:
         if store_files_at is None:
@@ -125,6 +221,54 @@ class GridFsDownloadBase:
             store_files_at = to_str_tuple(store_files_at)
 
         self.storage_options = store_files_at
+        if uconfig is not None:
+            if cache_quota is None:
+                cache_quota = uconfig.get('RunDB', 'resource_cache_quota', fallback=None)
+            if cache_policy is None:
+                cache_policy = uconfig.get('RunDB', 'resource_cache_policy', fallback=None)
+        self.cache_quota = cache_quota
+        self.cache_policy = cache_policy or 'lru'
+        self._resource_cache = None
+
+    @property
+    def resource_cache(self):
+        """
+        Index of the files in the folder we store new files in, None if
+        we cannot write to any of the storage_options
+        """
+        # Only create it when needed, this creates the folder
+        if self._resource_cache is None:
+            try:
+                folder = self._check_store_files_at(self.storage_options)
+            except PermissionError:
+                # we can still use the files in read only folders
+                return None
+            self._resource_cache = ResourceCache(
+                folder, quota=self.cache_quota, policy=self.cache_policy)
+        return self._resource_cache
+
+    def find_cached(self, target_file_name, name=None):
+        """
+        Find where target_file_name is stored in the storage_options
+
+        :param target_file_name: str, the name of the file (its md5)
+        :param name: str, the name the file is stored under in the database
+        :return: str, the path of the file or None if we do not have it
+        """
+        resource_cache = self.resource_cache
+        if resource_cache is not None:
+            path = resource_cache.lookup(target_file_name)
+            if path is not None:
+                return path
+        # Not in the index, it might predate the index or be in one of
+        # the (read only) folders managed by someone else.
+        for cache_folder in self.storage_options:
+            possible_path = os.path.join(cache_folder, target_file_name)
+            if os.path.exists(possible_path):
+                if resource_cache is None:
+                    return possible_path
+                return resource_cache.add(target_file_name, possible_path, name)
+        return None
 
     def download_single(self,
                         config_name: str,
@@ -132,6 +276,21 @@ class GridFsDownloadBase:
                         human_readable_file_name=False):
         raise NotImplementedError
 
+    def download_many(self, config_names, max_workers=4, **kwargs):
+        """
+        Download many files at once, using a pool of max_workers threads.
+
+        :param config_names: iterable of the names the files are stored under
+        :param max_workers: int, number of files to download at once
+        :param kwargs: passed on to download_single
+
+        :return: dict, for every config_name either the absolute path of
+            the file or the exception that made the download fail
+        """
+        return run_concurrently(lambda config_name: self.download_single(config_name, **kwargs),
+                                ((config_name,) for config_name in config_names),
+                                max_workers, 'downloading')
+
     def download_all(self):
         """Download all the files that are stored in the mongo collection"""
         raise NotImplementedError('This feature is disabled for now')
@@ -261,6 +420,10 @@ class GridFsInterfaceMongo(GridFsBase):
         query = {'md5': self.compute_md5(abs_path)}
         return self.collection.count_documents(query) > 0
 
+    def find_files(self, query, projection):
+        """Get the documents in fs.files matching the query"""
+        return list(self.collection.find(query, projection))
+
     def test_find(self):
         """
         Test the connection to the self.collection to see if we can
@@ -298,39 +461,6 @@ class MongoUploader(GridFsInterfaceMongo, GridFsUploadBase):
                 "How can you upload if you want to operate in readonly?")
         GridFsInterfaceMongo.__init__(self, *args, readonly=readonly, **kwargs)
 
-    def upload_from_dict(self, file_path_dict):
-        """
-        Upload all files in the dictionary to the database.
-
-        :param file_path_dict: dict, dictionary of paths to upload. The
-            dict should be of the format:
-            file_path_dict = {'config_name':  '/the_config_path', ...}
-
-        :return: None
-        """
-        if not isinstance(file_path_dict, dict):
-            raise ValueError(f'file_path_dict must be dict of form '
-                             f'"dict(NAME=ABSOLUTE_PATH,...)". Got '
-                             f'{type(file_path_dict)} instead')
-
-        for config, abs_path in tqdm(file_path_dict.items()):
-            # We need to do this expensive check here. It is not enough
-            # to just check that the file is stored under the
-            # 'config_identifier'. What if the file changed? Then we
-            # want to upload a new file! Otherwise we could have done
-            # the self.config_exists-query. If it turns out we have the
-            # exact same file, forget about uploading it.
-            if self.config_exists(config) and self.md5_stored(abs_path):
-                continue
-            else:
-                # This means we are going to upload the file because its
-                # not stored yet.
-                try:
-                    self.upload_single(config, abs_path)
-                except (CouldNotLoadError, ConfigTooLargeError):
-                    # Perhaps we should fail then?
-                    warn(f'Cannot upload {config}')
-
     def upload_single(self, config, abs_path):
         """
         Upload a single file to gridfs
@@ -355,9 +485,20 @@ class MongoDownloader(GridFsInterfaceMongo, GridFsDownloadBase):
     Class to download files from GridFs
     """
 
-    def __init__(self, *args, **kwargs):
-        GridFsDownloadBase.__init__(self, *args)
+    def __init__(self, *args, download_workers=1, cache_quota=None, cache_policy=None,
+                 **kwargs):
+        """
+        :param download_workers: int, number of threads that fetch the
+            chunks of a file in parallel. With 1 (default) the file is
+            streamed sequentially, which also allows to resume an
+            interrupted download.
+        :param cache_quota: int or str, see GridFsDownloadBase
+        :param cache_policy: str, see GridFsDownloadBase
+        """
+        GridFsDownloadBase.__init__(self, *args, cache_quota=cache_quota,
+                                    cache_policy=cache_policy)
         GridFsInterfaceMongo.__init__(self, **kwargs)
+        self.download_workers = download_workers
 
     def get_gridfs_object(self,
                           config_name: str,):
@@ -408,12 +549,11 @@ class MongoDownloader(GridFsInterfaceMongo, GridFsDownloadBase):
             target_file_name = fs_object.md5
 
         if write_to is None:
-            for cache_folder in self.storage_options:
-                possible_path = os.path.join(cache_folder, target_file_name)
-                if os.path.exists(possible_path):
-                    # Great! This already exists. Let's just return
-                    # where it is stored.
-                    return possible_path
+            cached_path = self.find_cached(target_file_name, config_name)
+            if cached_path is not None:
+                # Great! This already exists. Let's just return
+                # where it is stored.
+                return cached_path
 
             # Apparently the file does not exist, let's find a place to
             # store the file and download it.
@@ -422,22 +562,116 @@ class MongoDownloader(GridFsInterfaceMongo, GridFsDownloadBase):
             store_files_at = write_to
         destination_path = os.path.join(store_files_at, target_file_name)
 
-        # Let's open a temporary directory, download the file, and
-        # try moving it to the destination_path. This prevents
-        # simultaneous writes of the same file.
-        with tempfile.TemporaryDirectory() as temp_directory_name:
-            temp_path = os.path.join(temp_directory_name, target_file_name)
-
-            with open(temp_path, 'wb') as stored_file:
-                # This is were we do the actual downloading!
-                warn(f'Downloading {config_name} to {destination_path}')
-                stored_file.write(self.open_response(fs_object))
+        if os.path.exists(destination_path):
+            return destination_path
 
+        # This is were we do the actual downloading! The file is written
+        # to destination_path + '.part' and only moved to the
+        # destination_path once complete, which allows to resume an
+        # interrupted download. Only one process downloads the file, the
+        # others wait for the lock and then find the file.
+        with target_lock(destination_path):
             if not os.path.exists(destination_path):
-                # Move the file to the place we want to store it.
-                move(temp_path, destination_path)
+                warn(f'Downloading {config_name} to {destination_path}')
+                if self.download_workers > 1:
+                    self.parallel_download_to_file(fs_object, destination_path,
+                                                   n_workers=self.download_workers)
+                else:
+                    self.stream_to_file(fs_object, destination_path)
+        if write_to is None and self.resource_cache is not None:
+            self.resource_cache.add(target_file_name, destination_path, config_name)
         return destination_path
 
+    def parallel_download_to_file(self, fs_object, destination_path, n_workers=8,
+                                  chunks_per_task=16):
+        """
+        Download the fs_object by reading ranges of its chunks from the
+        fs.chunks collection in parallel, and write them straight to their
+        offset in a preallocated file.
+
+        :param fs_object: gridfs.GridOut, the file to download
+        :param destination_path: str, where to store the file
+        :param n_workers: int, number of threads reading chunks
+        :param chunks_per_task: int, number of chunks each read covers
+        """
+        chunk_collection = self.collection.database['fs.chunks']
+        chunk_size = fs_object.chunk_size
+        n_chunks = -(-fs_object.length // chunk_size)
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(destination_path) or '.',
+                                         prefix=f'.{os.path.basename(destination_path)}.')
+        try:
+            with os.fdopen(fd, 'wb') as stored_file:
+                stored_file.truncate(fs_object.length)
+
+            def fetch_range(start):
+                written = 0
+                query = {'files_id': fs_object._id,
+                         'n': {'$gte': start, '$lt': start + chunks_per_task}}
+                with open(temp_path, 'r+b') as stored_file:
+                    for chunk in chunk_collection.find(query, sort=[('n', 1)]):
+                        stored_file.seek(chunk['n'] * chunk_size)
+                        stored_file.write(chunk['data'])
+                        written += 1
+                return written
+
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                n_written = sum(executor.map(fetch_range, range(0, n_chunks, chunks_per_task)))
+            if n_written != n_chunks:
+                raise CouldNotLoadError(f'Got {n_written} out of {n_chunks} chunks '
+                                        f'for {destination_path}')
+
+            # The chunks came in out of order, so the md5 can only be
+            # checked once the file is complete
+            expected_md5 = getattr(fs_object, 'md5', None)
+            if (expected_md5 is not None
+                    and self.compute_md5(temp_path, use_cache=False) != expected_md5):
+                raise CouldNotLoadError(f'Downloaded {destination_path} but the md5 does '
+                                        f'not match the one stored in GridFS')
+            os.replace(temp_path, destination_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def stream_to_file(self, fs_object, destination_path, chunk_size=1024 ** 2):
+        """
+        Write the fs_object to destination_path chunk by chunk. A partial
+        download left in destination_path + '.part' is resumed from its
+        offset, and the result is checked against the md5 stored with the
+        file.
+
+        :param fs_object: gridfs.GridOut, the file to download
+        :param destination_path: str, where to store the file
+        :param chunk_size: int, number of bytes to read at once
+        """
+        part_path = destination_path + '.part'
+        hash_md5 = hashlib.md5()
+        offset = 0
+        if os.path.exists(part_path):
+            with open(part_path, 'rb') as part_file:
+                # a partial file larger than the file itself is garbage
+                for chunk in iter(lambda: part_file.read(chunk_size), b''):
+                    if offset + len(chunk) > fs_object.length:
+                        break
+                    hash_md5.update(chunk)
+                    offset += len(chunk)
+
+        with open(part_path, 'r+b' if offset else 'wb') as stored_file:
+            stored_file.seek(offset)
+            stored_file.truncate()
+            fs_object.seek(offset)
+            for chunk in iter(lambda: fs_object.read(chunk_size), b''):
+                stored_file.write(chunk)
+                hash_md5.update(chunk)
+
+        expected_md5 = getattr(fs_object, 'md5', None)
+        if expected_md5 is not None and hash_md5.hexdigest() != expected_md5:
+            os.remove(part_path)
+            raise CouldNotLoadError(f'Downloaded {destination_path} but the md5 does not match '
+                                    f'the one stored in GridFS')
+        os.replace(part_path, destination_path)
+
     def get_abs_path(self, config_name):
         return self.download_single(config_name)
 
@@ -477,6 +711,10 @@ class GridFsInterfaceAPI(GridFsBase):
         query = {'md5': self.compute_md5(abs_path)}
         return self.db.count_files(query) > 0
 
+    def find_files(self, query, projection):
+        """Get the documents in fs.files matching the query"""
+        return self.db.get_files(query, projection=projection)
+
     def test_find(self):
         """
         Test the connection to the self.collection to see if we can
@@ -504,10 +742,113 @@ class GridFsInterfaceAPI(GridFsBase):
 class APIDownloader(GridFsInterfaceAPI, GridFsDownloadBase):
     """Download files using the runDB API"""
 
-    def __init__(self, config_identifier='config_name', store_files_at=None):
-        GridFsDownloadBase.__init__(self, store_files_at=store_files_at)
+    def __init__(self, config_identifier='config_name', store_files_at=None,
+                 cache_quota=None, cache_policy=None, md5_ttl=None,
+                 revalidate_in_background=None):
+        """
+        :param md5_ttl: float, seconds to trust the md5 we know for a
+            file name before asking the database again. Taken from the
+            [RunDB] file_md5_ttl config field if not specified (300).
+        :param revalidate_in_background: bool, return files of an expired
+            md5 right away and ask the database for the latest md5 in a
+            background thread. Taken from the [RunDB] file_md5_revalidate
+            config field if not specified.
+        """
+        GridFsDownloadBase.__init__(self, store_files_at=store_files_at,
+                                    cache_quota=cache_quota, cache_policy=cache_policy)
         GridFsInterfaceAPI.__init__(self, config_identifier=config_identifier)
+        if md5_ttl is None:
+            md5_ttl = (uconfig.getfloat('RunDB', 'file_md5_ttl', fallback=300)
+                       if uconfig is not None else 300)
+        if revalidate_in_background is None:
+            revalidate_in_background = (
+                uconfig.getboolean('RunDB', 'file_md5_revalidate', fallback=False)
+                if uconfig is not None else False)
+        self.md5_ttl = md5_ttl
+        self.revalidate_in_background = revalidate_in_background
+        self._revalidator = None
+        self._revalidating = set()
+        self._revalidate_lock = threading.Lock()
+
+    def get_md5(self, config_name, allow_stale=False):
+        """
+        Get the md5 of the latest version of config_name. The md5s we got
+        before are stored in the resource cache, only if it is older than
+        md5_ttl (or unknown) the database is asked.
 
+        :param config_name: str, the name under which the file is stored
+        :param allow_stale: bool, return an expired md5 right away and
+            refresh it in a background thread
+        :return: str, the md5
+        """
+        if self.resource_cache is None:
+            return self.db.get_file_md5(config_name)
+        md5, age = self.resource_cache.get_md5(config_name)
+        if md5 is not None and age < self.md5_ttl:
+            return md5
+        if md5 is not None and allow_stale:
+            self._revalidate(config_name)
+            return md5
+        return self.fetch_md5(config_name)
+
+    def fetch_md5(self, config_name):
+        """Ask the database for the md5 of config_name and remember it"""
+        md5 = self.db.get_file_md5(config_name)
+        if self.resource_cache is not None:
+            self.resource_cache.put_md5s({config_name: md5})
+        return md5
+
+    def refresh_md5s(self, config_names=None):
+        """
+        Get the md5 of many files with a single query instead of one call
+        per file
+
+        :param config_names: iterable of names, None for all the files
+        :return: dict, name -> md5 of the latest version of every file
+        """
+        query = {}
+        if config_names is not None:
+            query = {self.config_identifier: {'$in': list(config_names)}}
+        docs = self.db.get_files(query, projection={self.config_identifier: 1,
+                                                    'md5': 1,
+                                                    'uploadDate': 1})
+        # There might be more versions of a file, the last one uploaded wins
+        md5s = {}
+        for doc in sorted(docs, key=lambda doc: upload_timestamp(doc.get('uploadDate'))):
+            if self.config_identifier in doc and 'md5' in doc:
+                md5s[doc[self.config_identifier]] = doc['md5']
+        if self.resource_cache is not None:
+            self.resource_cache.put_md5s(md5s)
+        return md5s
+
+    def _revalidate(self, config_name):
+        with self._revalidate_lock:
+            if config_name in self._revalidating:
+                return
+            self._revalidating.add(config_name)
+            if self._revalidator is None:
+                self._revalidator = ThreadPoolExecutor(max_workers=1)
+
+        def done(future):
+            self._revalidating.discard(config_name)
+            if future.exception() is not None:
+                logger.warning(f'Could not revalidate the md5 of {config_name}: '
+                               f'{future.exception()}')
+
+        self._revalidator.submit(self.fetch_md5, config_name).add_done_callback(done)
+
+    def download_many(self, config_names, max_workers=4, **kwargs):
+        """See GridFsDownloadBase.download_many"""
+        config_names = list(config_names)
+        # Get the md5s we do not know (anymore) with one query, without
+        # a resource cache there is nowhere to remember them
+        if self.resource_cache is not None and not kwargs.get('human_readable_file_name'):
+            ages = [self.resource_cache.get_md5(config_name)[1] for config_name in config_names]
+            expired = [config_name for config_name, age in zip(config_names, ages)
+                       if age is None or age >= self.md5_ttl]
+            if expired:
+                self.refresh_md5s(expired)
+        return GridFsDownloadBase.download_many(self, config_names, max_workers, **kwargs)
 
     def download_single(self,
                         config_name: str,
@@ -529,33 +870,44 @@ class APIDownloader(GridFsInterfaceAPI, GridFsDownloadBase):
         if human_readable_file_name:
             target_file_name = config_name
         else:
-            target_file_name = self.db.get_file_md5(config_name)
+            # With a warm cache we know the md5 and have the file, so
+            # there is no need to ask the database at all
+            target_file_name = self.get_md5(
+                config_name,
+                allow_stale=self.revalidate_in_background and write_to is None)
 
         if write_to is None:
-            for cache_folder in self.storage_options:
-                possible_path = os.path.join(cache_folder, target_file_name)
-                if os.path.exists(possible_path):
-                    # Great! This already exists. Let's just return
-                    # where it is stored.
-                    return possible_path
+            cached_path = self.find_cached(target_file_name, config_name)
+            if cached_path is not None:
+                # Great! This already exists. Let's just return
+                # where it is stored.
+                return cached_path
 
             # Apparently the file does not exist, let's find a place to
             # store the file and download it.
             store_files_at = self._check_store_files_at(self.storage_options)
+            if not human_readable_file_name:
+                # We might have got an expired md5, make sure we download
+                # the latest version
+                target_file_name = self.get_md5(config_name)
         else:
             store_files_at = write_to
         destination_path = os.path.join(store_files_at, target_file_name)
 
-        # Let's open a temporary directory, download the file, and
-        # try moving it to the destination_path. This prevents
-        # simultaneous writes of the same file.
-        with tempfile.TemporaryDirectory() as temp_directory_name:
-            temp_path = self.db.download_file(config_name, save_dir=temp_directory_name)
+        if os.path.exists(destination_path):
+            warn(f"File {destination_path} already exists. Not overwriting.")
+            return destination_path
+
+        # The file is streamed to a temporary file next to the
+        # destination_path and only moved there once complete (and
+        # matching the md5). Only one process downloads the file, the
+        # others wait for the lock and then find the file.
+        with target_lock(destination_path):
             if not os.path.exists(destination_path):
-                # Move the file to the place we want to store it.
-                move(temp_path, destination_path)
-            else:
-                warn(f"File {destination_path} already exists. Not overwriting.")
+                self.db.stream_file(config_name, destination_path,
+                                    md5=None if human_readable_file_name else target_file_name)
+        if write_to is None and self.resource_cache is not None:
+            self.resource_cache.add(target_file_name, destination_path, config_name)
         return destination_path
 
 
@@ -572,12 +924,16 @@ class APIUploader(GridFsInterfaceAPI, GridFsUploadBase):
             stored
 
         :param abs_path: str, the absolute path of the file
+
+        :return: str, the md5 of the uploaded file
         """
         if not os.path.exists(abs_path):
             raise CouldNotLoadError(f'{abs_path} does not exist')
 
         logger.info(f'uploading file {config} from {abs_path}')
-        self.db.upload_file(abs_path, config)
+        _, md5 = self.db.upload_file(abs_path, config, return_md5=True)
+        logger.debug(f'uploaded {config} with md5 {md5}')
+        return md5
 
 
 class CouldNotLoadError(Exception):
@@ -594,6 +950,73 @@ class ConfigTooLargeError(Exception):
     pass
 
 
+# What can go wrong with a single file, these don't stop the other
+# transfers of run_concurrently
+TRANSFER_ERRORS = (CouldNotLoadError, ConfigTooLargeError, APIError, PyMongoError,
+                   RuntimeError, ValueError, OSError)
+
+
+def run_concurrently(func, args_list, max_workers, desc=None):
+    """
+    Call func(*args) for all the args in args_list on a pool of threads,
+    showing the aggregated progress. Calls failing with one of the
+    TRANSFER_ERRORS are reported with a warning, any other exception is
+    raised.
+
+    :return: dict, args[0] -> result, or the exception for the failed
+        calls, in the order of args_list
+    """
+    args_list = list(args_list)
+    # keep the order of args_list
+    results = {args[0]: None for args in args_list}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            tqdm(total=len(args_list), desc=desc) as progress:
+        futures = {executor.submit(func, *args): args[0] for args in args_list}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except TRANSFER_ERRORS as e:
+                warn(f'Cannot transfer {name}: {e}')
+                results[name] = e
+            progress.update(1)
+    return results
+
+
+def upload_timestamp(upload_date):
+    """
+    Convert the uploadDate of a file document to a unix timestamp. The API
+    returns it as an RFC 1123 string (Wed, 21 Oct 2015 07:28:00 GMT), an
+    ISO 8601 string or as extended json ({'$date': ...}).
+
+    :return: float, the timestamp or -inf if it cannot be parsed
+    """
+    if isinstance(upload_date, dict) and '$date' in upload_date:
+        upload_date = upload_date['$date']
+        if isinstance(upload_date, dict):
+            # {'$date': {'$numberLong': '1445412480000'}}
+            upload_date = upload_date.get('$numberLong')
+        try:
+            # milliseconds since the epoch
+            return int(upload_date) / 1000
+        except (TypeError, ValueError):
+            pass
+    if isinstance(upload_date, str):
+        try:
+            upload_date = parsedate_to_datetime(upload_date)
+        except (TypeError, ValueError):
+            try:
+                upload_date = datetime.fromisoformat(upload_date.replace('Z', '+00:00'))
+            except ValueError:
+                upload_date = None
+    if isinstance(upload_date, datetime):
+        if upload_date.tzinfo is None:
+            # mongo stores the dates in UTC
+            upload_date = upload_date.replace(tzinfo=timezone.utc)
+        return upload_date.timestamp()
+    return float('-inf')
+
+
 def to_str_tuple(x) -> ty.Tuple[str]:
     """
     Convert x to tuple of string
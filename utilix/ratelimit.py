@@ -0,0 +1,115 @@
+"""
+Client side rate limiting of the runDB API calls, so that many workers
+sharing one API user stay below the rate the server accepts instead of
+running into 429s.
+"""
+
+import os
+import threading
+import time
+
+from . import uconfig
+from .locking import file_lock
+
+
+def max_in_flight_from_config():
+    """
+    The [RunDB] api_max_in_flight config field, None if it is not set,
+    empty or 0 (no limit)
+    """
+    if uconfig is None:
+        return None
+    value = uconfig.get('RunDB', 'api_max_in_flight', fallback='').strip()
+    return int(value) or None if value else None
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the number of requests per second, combined with
+    a maximum number of requests in flight. Callers that are over the limit
+    are queued (they sleep) instead of failing.
+
+    The bucket can be shared by all processes on a node by giving it a
+    shared_file, its state is then kept in that file under a file lock.
+    """
+
+    def __init__(self, rate=None, burst=None, max_in_flight=None, shared_file=None):
+        """
+        :param rate: float, requests per second, None for no limit
+        :param burst: float, size of the bucket, i.e. how many requests
+            can be done at once after being idle. Defaults to rate.
+        :param max_in_flight: int, maximum number of concurrent requests
+            of this process, None for no limit
+        :param shared_file: str, path of a file to share the bucket
+            between processes
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate or 1, 1)
+        self.shared_file = shared_file
+        self._semaphore = (threading.BoundedSemaphore(max_in_flight)
+                           if max_in_flight else None)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._last = time.time()
+        self.waited = 0.
+
+    @classmethod
+    def from_config(cls):
+        """
+        Read the limits from the [RunDB] section of the config, returns
+        None if no limits are configured
+        """
+        if uconfig is None:
+            return None
+        rate = uconfig.getfloat('RunDB', 'api_rate_limit', fallback=0) or None
+        max_in_flight = max_in_flight_from_config()
+        if rate is None and max_in_flight is None:
+            return None
+        return cls(rate=rate,
+                   burst=uconfig.getfloat('RunDB', 'api_burst', fallback=None),
+                   max_in_flight=max_in_flight,
+                   shared_file=uconfig.get('RunDB', 'api_rate_limit_file', fallback=None))
+
+    def _take(self, tokens, last, now):
+        tokens = min(self.burst, tokens + (now - last) * self.rate) - 1
+        return tokens, max(0., -tokens / self.rate)
+
+    def reserve(self):
+        """
+        Take a token from the bucket. If the bucket is empty, the token is
+        borrowed from the future.
+
+        :return: float, seconds to wait before the request can be done
+        """
+        if self.rate is None:
+            return 0.
+        now = time.time()
+        if self.shared_file is None:
+            with self._lock:
+                self._tokens, wait = self._take(self._tokens, self._last, now)
+                self._last = now
+        else:
+            with file_lock(self.shared_file) as fd:
+                try:
+                    tokens, last = map(float, os.read(fd, 64).split())
+                except ValueError:
+                    # new (or garbled) file, start with a full bucket
+                    tokens, last = self.burst, now
+                tokens, wait = self._take(tokens, last, now)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, f'{tokens} {now}'.encode())
+        self.waited += wait
+        return wait
+
+    def __enter__(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._semaphore is not None:
+            self._semaphore.release()
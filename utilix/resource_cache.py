@@ -0,0 +1,279 @@
+"""
+Managed local store of the files downloaded from GridFS.
+
+The downloaders store files under their md5 in a cache folder. The
+ResourceCache keeps a small sqlite index of these files (key -> name,
+path, size, last access and number of hits) so that lookups are a single
+query, and keeps the folder below a byte quota by evicting the least
+recently (lru) or least frequently (lfu) used files.
+
+It also remembers the md5 of the latest version of every file name, so
+that finding the file of a name does not need a call to the database.
+
+The index only holds information that can be recovered from the folder
+itself, if it gets lost or corrupted just delete it and run the garbage
+collection:
+
+    python -m utilix.resource_cache gc ./resource_cache --quota 50G
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import threading
+import time
+
+INDEX_NAME = '.utilix_index.sqlite'
+POLICIES = {'lru': 'last_access ASC',
+            'lfu': 'hits ASC, last_access ASC'}
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(size):
+    """Convert a size like 500M or 20G (or a plain number of bytes) to bytes"""
+    if size is None or isinstance(size, (int, float)):
+        return size
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?)I?B?\s*', size.upper())
+    if match is None:
+        raise ValueError(f'Cannot parse size {size}')
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
+class ResourceCache:
+    """
+    Index of the files in a cache folder with size bounded eviction. The
+    index is shared by all processes using the folder.
+    """
+
+    def __init__(self, folder, quota=None, policy='lru'):
+        """
+        :param folder: str, the folder the files are stored in, the index
+            is kept in the same folder
+        :param quota: int or str, maximum total size of the files in
+            folder (e.g. 50G), None for no limit
+        :param policy: str, which files to evict first, 'lru' (least
+            recently used) or 'lfu' (least frequently used)
+        """
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown eviction policy {policy}, choose from {list(POLICIES)}')
+        os.makedirs(folder, exist_ok=True)
+        self.folder = os.path.abspath(folder)
+        self.index_path = os.path.join(self.folder, INDEX_NAME)
+        self.quota = parse_size(quota)
+        self.policy = policy
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def _conn(self):
+        # sqlite connections can not be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.index_path, timeout=60, isolation_level=None)
+            # The index can be rebuilt from the folder, no need to pay
+            # for an fsync on every lookup
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS files ('
+                         'key TEXT PRIMARY KEY, name TEXT, path TEXT, size INTEGER, '
+                         'last_access REAL, hits INTEGER, managed INTEGER)')
+            conn.execute('CREATE TABLE IF NOT EXISTS md5s ('
+                         'name TEXT PRIMARY KEY, md5 TEXT, fetched_at REAL)')
+            self._local.conn = conn
+        return conn
+
+    def _managed(self, path):
+        """Is path in our folder, i.e. do we count and evict it"""
+        return os.path.dirname(os.path.abspath(path)) == self.folder
+
+    def lookup(self, key):
+        """
+        Get the path of the file stored under key and mark it as used
+
+        :return: str, the path or None if the file is not in the cache
+        """
+        row = self._conn.execute('SELECT path FROM files WHERE key = ?', (key,)).fetchone()
+        if row is not None and not os.path.exists(row[0]):
+            # removed behind our back
+            self._conn.execute('DELETE FROM files WHERE key = ?', (key,))
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self._conn.execute('UPDATE files SET last_access = ?, hits = hits + 1 WHERE key = ?',
+                           (time.time(), key))
+        self.hits += 1
+        return row[0]
+
+    def add(self, key, path, name=None):
+        """
+        Add the file at path to the index under key and evict other files
+        if we are over the quota
+
+        :param key: str, the key to look the file up with (usually the md5)
+        :param path: str, where the file is stored
+        :param name: str, the name the file is stored under in the database
+        :return: str, path
+        """
+        path = os.path.abspath(path)
+        self._conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, '
+                           'COALESCE((SELECT hits FROM files WHERE key = ?), 0), ?)',
+                           (key, name, path, os.path.getsize(path), time.time(),
+                            key, int(self._managed(path))))
+        if self.quota is not None:
+            self.evict(keep=(key,))
+        return path
+
+    def remove(self, key):
+        """Remove the file stored under key from the index and the disk"""
+        row = self._conn.execute('SELECT path FROM files WHERE key = ?', (key,)).fetchone()
+        self._conn.execute('DELETE FROM files WHERE key = ?', (key,))
+        if row is not None:
+            self._remove_file(row[0])
+
+    def get_md5(self, name):
+        """
+        Get the md5 of the file name as it was last stored with put_md5s
+
+        :return: tuple of (md5, age in seconds), (None, None) if unknown
+        """
+        row = self._conn.execute('SELECT md5, fetched_at FROM md5s WHERE name = ?',
+                                 (name,)).fetchone()
+        if row is None:
+            return None, None
+        return row[0], time.time() - row[1]
+
+    def put_md5s(self, md5s):
+        """
+        Store the md5s of file names
+
+        :param md5s: dict of name -> md5
+        """
+        now = time.time()
+        self._conn.executemany('INSERT OR REPLACE INTO md5s VALUES (?, ?, ?)',
+                               [(name, md5, now) for name, md5 in md5s.items()])
+
+    def evict(self, quota=None, keep=()):
+        """
+        Remove files from our folder until their total size is below quota
+
+        :param quota: int or str, defaults to the quota of the cache
+        :param keep: tuple of keys that should not be evicted
+        :return: list, the paths of the evicted files
+        """
+        quota = parse_size(quota) if quota is not None else self.quota
+        if quota is None:
+            return []
+        conn = self._conn
+        # Take the write lock up front so that processes evicting at the
+        # same time do not remove more than needed
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM files '
+                                 'WHERE managed = 1').fetchone()[0]
+            evicted = []
+            if total > quota:
+                rows = conn.execute(f'SELECT key, path, size FROM files WHERE managed = 1 '
+                                    f'ORDER BY {POLICIES[self.policy]}').fetchall()
+                for key, path, size in rows:
+                    if total <= quota:
+                        break
+                    if key in keep:
+                        continue
+                    conn.execute('DELETE FROM files WHERE key = ?', (key,))
+                    evicted.append(path)
+                    total -= size
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        for path in evicted:
+            self._remove_file(path)
+        self.evictions += len(evicted)
+        return evicted
+
+    def gc(self, quota=None, max_partial_age=24 * 3600):
+        """
+        Garbage collect the cache folder:
+         - drop the index entries of files that no longer exist
+         - add files in the folder that are not indexed yet
+         - remove leftovers of interrupted downloads older than
+           max_partial_age seconds
+         - evict files until we are below the quota
+
+        :return: dict, the number of files affected by every step
+        """
+        conn = self._conn
+        dropped = 0
+        for key, path in conn.execute('SELECT key, path FROM files').fetchall():
+            if not os.path.exists(path):
+                conn.execute('DELETE FROM files WHERE key = ?', (key,))
+                dropped += 1
+
+        indexed = {row[0] for row in conn.execute('SELECT path FROM files')}
+        added = removed = 0
+        now = time.time()
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.name.startswith(INDEX_NAME):
+                    continue
+                stat = entry.stat()
+                if entry.name.startswith('.') or entry.name.endswith(('.part', '.lock')):
+                    # temporary files of (interrupted) downloads
+                    if now - stat.st_mtime > max_partial_age:
+                        self._remove_file(entry.path)
+                        removed += 1
+                    continue
+                if entry.path not in indexed:
+                    conn.execute('INSERT OR IGNORE INTO files VALUES (?, NULL, ?, ?, ?, 0, 1)',
+                                 (entry.name, entry.path, stat.st_size, stat.st_atime))
+                    added += 1
+        evicted = self.evict(quota)
+        return dict(dropped=dropped, added=added, removed_partial=removed, evicted=len(evicted))
+
+    @property
+    def stats(self):
+        entries, nbytes, total_hits = self._conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) '
+            'FROM files WHERE managed = 1').fetchone()
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    evictions=self.evictions,
+                    entries=entries,
+                    nbytes=nbytes,
+                    quota=self.quota,
+                    total_hits=total_hits)
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except PermissionError:
+            # e.g. a read only shared folder, nothing we can do about it
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Maintenance of the utilix resource cache')
+    parser.add_argument('command', choices=('gc', 'stats'))
+    parser.add_argument('folder', help='the cache folder')
+    parser.add_argument('--quota', default=None,
+                        help='maximum size of the files in the folder, e.g. 50G')
+    parser.add_argument('--policy', default='lru', choices=tuple(POLICIES))
+    parser.add_argument('--max-partial-age', type=float, default=24,
+                        help='remove interrupted downloads older than this many hours')
+    args = parser.parse_args(argv)
+
+    cache = ResourceCache(args.folder, quota=args.quota, policy=args.policy)
+    if args.command == 'gc':
+        print(cache.gc(max_partial_age=args.max_partial_age * 3600))
+    print(cache.stats)
+
+
+if __name__ == '__main__':
+    main()
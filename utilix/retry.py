@@ -0,0 +1,137 @@
+"""
+Retry policy and circuit breaker for the runDB API calls.
+
+ - RetryPolicy: how often and how long to wait before retrying a call
+    that failed with a transient error (429/502/503/504 or a dropped
+    connection)
+ - CircuitBreaker: stop calling the API for a while after too many
+    consecutive failures, so we fail fast while it is down
+"""
+
+import datetime
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from . import uconfig
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, honouring Retry-After"""
+
+    def __init__(self, max_retries=3, backoff=0.5, max_backoff=30,
+                 retry_statuses=(429, 502, 503, 504)):
+        """
+        :param max_retries: int, number of retries after the first attempt
+        :param backoff: float, base delay in seconds, doubled every retry
+        :param max_backoff: float, maximum delay in seconds
+        :param retry_statuses: tuple of the status codes to retry on
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = retry_statuses
+        self.retries = 0
+
+    @classmethod
+    def from_config(cls):
+        """Read the policy from the [RunDB] section of the config"""
+        if uconfig is None:
+            return cls()
+        return cls(max_retries=uconfig.getint('RunDB', 'api_max_retries', fallback=3),
+                   backoff=uconfig.getfloat('RunDB', 'api_retry_backoff', fallback=0.5),
+                   max_backoff=uconfig.getfloat('RunDB', 'api_retry_max_backoff', fallback=30))
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Seconds to wait before retry number attempt (starting at 0)
+
+        :param retry_after: str, value of the Retry-After header, if any
+        """
+        if retry_after:
+            try:
+                seconds = float(retry_after)
+            except ValueError:
+                try:
+                    date = parsedate_to_datetime(retry_after)
+                    seconds = (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    seconds = None
+            if seconds is not None:
+                return min(max(seconds, 0), self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures. While open, calls
+    are refused until reset_timeout seconds have passed, then a single
+    trial call is let through: if it succeeds the breaker closes again,
+    otherwise it stays open for another reset_timeout. If the result of
+    the trial is never recorded, another one is let through after
+    reset_timeout.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._lock = threading.Lock()
+
+        # counters for monitoring
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+
+    @classmethod
+    def from_config(cls):
+        """Read the breaker settings from the [RunDB] section of the config"""
+        if uconfig is None:
+            return cls()
+        return cls(failure_threshold=uconfig.getint('RunDB', 'api_breaker_threshold', fallback=5),
+                   reset_timeout=uconfig.getfloat('RunDB', 'api_breaker_reset', fallback=30))
+
+    def allow(self):
+        """Can we do a call now?"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state != self.CLOSED and now - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                # don't wait forever on a trial that was lost
+                self._opened_at = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self._failures = 0
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    @property
+    def stats(self):
+        return dict(state=self.state,
+                    successes=self.successes,
+                    failures=self.failures,
+                    rejected=self.rejected,
+                    opened=self.opened)
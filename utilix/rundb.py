@@ -1,14 +1,24 @@
 import os
+from urllib.parse import urlencode
 import requests
+from requests.adapters import HTTPAdapter
 import re
 import json
+import contextlib
 import datetime
+import functools
+import hashlib
 import logging
 import pymongo
 from warnings import warn
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from . import uconfig, io
+from . import uconfig, io, json_backend
+from .cache import ResponseCache, DocumentCache
+from .retry import RetryPolicy, CircuitBreaker
+from .ratelimit import RateLimiter
+from .locking import target_lock
 from .config import setup_logger
 
 
@@ -22,35 +32,171 @@ else:
     logger = setup_logger()
 
 
+def make_session(pool_size=None, keep_alive=None):
+    """
+    Create a requests.Session with a connection pool for the runDB API.
+    Re-using the session avoids a new TCP+TLS handshake for every call.
+
+    :param pool_size: int, number of connections kept in the pool. Taken
+        from the [RunDB] api_pool_size config field if not specified.
+    :param keep_alive: bool, keep connections open between calls. Taken
+        from the [RunDB] api_keep_alive config field if not specified.
+    :return: requests.Session
+    """
+    if pool_size is None:
+        pool_size = (uconfig.getint('RunDB', 'api_pool_size', fallback=20)
+                     if uconfig is not None else 20)
+    if keep_alive is None:
+        keep_alive = (uconfig.getboolean('RunDB', 'api_keep_alive', fallback=True)
+                      if uconfig is not None else True)
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
 class NewTokenError(Exception):
     pass
 
 
 class APIError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# 206 is the answer to a request for part of a file (Range header)
+SUCCESS_CODES = (200, 206)
+
+
+def check_status(url, status_code, text):
+    """Raise an APIError if the API call to url did not succeed"""
+    if status_code not in SUCCESS_CODES:
+        logger.error("\n\tAPI Call was {0}\n\tReturn code: {1}\n\tReason: {2} ".format(
+            url,
+            status_code,
+            text,
+        ))
+
+        if status_code == 401:
+            raise APIError(
+                "Error 401 is an authentication error. This is likely an issue with your token. "
+                "Can you do 'rm ~/.dbtoken' and try again? ", status_code)
+        else:
+            raise APIError("API called failed", status_code)
+
+
+class CircuitOpenError(APIError):
+    """Raised without calling the API while the circuit breaker is open"""
     pass
 
 
+# Only these calls are retried, a POST might not be safe to repeat
+IDEMPOTENT_CALLS = ('_get_uncached', '_put', '_delete')
+
+
 def Responder(func):
+    idempotent = func.__name__ in IDEMPOTENT_CALLS
+
+    @functools.wraps(func)
     def func_wrapper(*args, **kwargs):
-        st = func(*args, **kwargs)
-        if st.status_code != 200:
-            logger.error("\n\tAPI Call was {0}\n\tReturn code: {1}\n\tReason: {2} ".format(
-                args[1],
-                st.status_code,
-                st.text,
-            ))
-
-            if st.status_code == 401:
-                raise APIError(
-                    "Error 401 is an authentication error. This is likely an issue with your token. "
-                    "Can you do 'rm ~/.dbtoken' and try again? ")
+        db, url = args[0], args[1]
+        policy = getattr(db, 'retry_policy', None)
+        breaker = getattr(db, 'circuit_breaker', None)
+        limiter = getattr(db, 'rate_limiter', None) or contextlib.nullcontext()
+        max_retries = policy.max_retries if (policy is not None and idempotent) else 0
+
+        attempt = 0
+        while True:
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError(
+                    f"Not calling {url}, the API failed too often recently", 503)
+            try:
+                with limiter:
+                    st = func(*args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if breaker is not None:
+                    breaker.record_failure()
+                if attempt >= max_retries:
+                    raise
+                delay = policy.delay(attempt)
+                logger.info(f'{url} failed ({e}), retrying in {delay:.1f} s')
+            except (KeyboardInterrupt, GeneratorExit):
+                # stopped by the caller, not a failure of the API
+                raise
+            except BaseException:
+                # e.g. a broken chunked response, still a failed call
+                if breaker is not None:
+                    breaker.record_failure()
+                raise
             else:
-                raise APIError("API called failed")
+                transient = policy is not None and st.status_code in policy.retry_statuses
+                if breaker is not None:
+                    if transient:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                if not transient or attempt >= max_retries:
+                    break
+                delay = policy.delay(attempt, st.headers.get('Retry-After'))
+                logger.info(f'{url} returned {st.status_code}, retrying in {delay:.1f} s')
+                st.close()
+            attempt += 1
+            policy.retries += 1
+            time.sleep(delay)
+
+        if st.status_code not in SUCCESS_CODES:
+            check_status(url, st.status_code, st.text)
         return st
 
     return func_wrapper
 
 
+def default_token_path():
+    """Path of the token file, ~/.dbtoken unless specified otherwise"""
+    if 'HOME' not in os.environ:
+        logger.error('$HOME is not defined in the environment')
+        if 'USERPROFILE' in os.environ:
+            # Are you on windows?
+            return os.path.join(os.environ['USERPROFILE'], '.dbtoken')
+    else:
+        return os.path.join(os.environ['HOME'], ".dbtoken")
+
+
+def filter_data(data, filters, projection=None):
+    """
+    Select the entries of a data list that match all the key/values in
+    filters and optionally only keep the fields in projection. The
+    filters are applied before the projection, so they can be on fields
+    that are not projected.
+    """
+    items = tuple(filters.items())
+    ret = [d for d in data if all(d.get(key) == val for key, val in items)]
+    if projection is not None:
+        ret = [{key: d[key] for key in projection if key in d} for d in ret]
+    return ret
+
+
+def data_query_string(filters, projection=None):
+    """
+    Encode the filters and projection of a data query for the url. The
+    keys of the filters are added to the projection, the entries are
+    filtered again locally (see filter_data) and need them for that.
+    """
+    params = {}
+    if filters:
+        params['filters'] = json.dumps(filters)
+    if projection is not None:
+        projection = list(projection)
+        projection += [key for key in filters if key not in projection]
+        params['projection'] = ','.join(projection)
+    return '?' + urlencode(params) if params else ''
+
+
 class Token:
     """
     Object handling tokens for runDB API access.
@@ -60,8 +206,10 @@ class Token:
     user = None
     creation_time = None
 
-    def __init__(self, path):
+    def __init__(self, path, session=None):
         self.path = path
+        # share the connection pool of the DB if we are given one
+        self.session = session if session is not None else requests.Session()
 
         # if token path exists, read it in. Otherwise make a new one
         if os.path.exists(path):
@@ -113,7 +261,7 @@ class Token:
         success = False
         for _try in range(3):
             try:
-                response = requests.post(path, data=data, headers=BASE_HEADERS)
+                response = self.session.post(path, data=data, headers=BASE_HEADERS)
                 response_json = json.loads(response.text)
                 success = True
                 break
@@ -153,7 +301,7 @@ class Token:
         headers = BASE_HEADERS.copy()
         headers['Authorization'] = f"Bearer {self.token_string}"
         logger.debug(f"Refreshing your token with API call {url}")
-        response = requests.get(url, headers=headers)
+        response = self.session.get(url, headers=headers)
         response_json = json.loads(response.text)
         logger.debug(f'The response contains these keys: {list(response_json.keys())}')
         # if renew fails, try logging back in
@@ -176,41 +324,129 @@ class Token:
 class DB():
     """Wrapper around the RunDB API"""
 
-    def __init__(self, token_path=None):
+    def __init__(self, token_path=None, pool_size=None, keep_alive=None, cache=None,
+                 doc_cache=None):
+        """
+        :param token_path: str, path to the serialized token. Defaults
+            to ~/.dbtoken
+        :param pool_size: int, number of pooled connections, see make_session
+        :param keep_alive: bool, keep connections open, see make_session
+        :param cache: bool or utilix.cache.ResponseCache, cache the
+            responses of the read endpoints in memory. Taken from the
+            [RunDB] api_cache config field if not specified (off by
+            default).
+        :param doc_cache: bool or utilix.cache.DocumentCache, cache the run
+            documents of get_doc on disk so that processes on the same node
+            share them. Taken from the [RunDB] doc_cache config field if
+            not specified (off by default). The documents are stored in
+            [RunDB] doc_cache_dir (default: .dbcache next to the token)
+            for [RunDB] doc_cache_ttl seconds (default: 3600).
+        """
 
         if token_path is None:
-            if 'HOME' not in os.environ:
-                logger.error('$HOME is not defined in the environment')
-                if 'USERPROFILE' in os.environ:
-                    # Are you on windows?
-                    token_path = os.path.join(os.environ['USERPROFILE'], '.dbtoken')
-            else:
-                token_path = os.path.join(os.environ['HOME'], ".dbtoken")
+            token_path = default_token_path()
+
+        # All API calls (including the token handling) go through one
+        # pooled session so that connections are re-used
+        self.session = make_session(pool_size=pool_size, keep_alive=keep_alive)
 
         # Takes a path to serialized token object
-        token = Token(token_path)
+        token = Token(token_path, session=self.session)
 
         self.headers = BASE_HEADERS.copy()
         self.headers['Authorization'] = "Bearer {token}".format(token=token())
 
+        if cache is None:
+            cache = uconfig.getboolean('RunDB', 'api_cache', fallback=False)
+        if cache is True:
+            cache = ResponseCache(
+                max_entries=uconfig.getint('RunDB', 'api_cache_entries', fallback=1024),
+                max_bytes=uconfig.getint('RunDB', 'api_cache_bytes', fallback=64 * 1024 ** 2))
+        self.cache = cache or None
+
+        if doc_cache is None:
+            doc_cache = uconfig.getboolean('RunDB', 'doc_cache', fallback=False)
+        if doc_cache is True:
+            doc_cache = DocumentCache(
+                uconfig.get('RunDB', 'doc_cache_dir',
+                            fallback=os.path.join(os.path.dirname(token_path), '.dbcache')),
+                ttl=uconfig.getfloat('RunDB', 'doc_cache_ttl', fallback=3600))
+        self.doc_cache = doc_cache or None
+
+        # transient errors are retried, and we fail fast if the API is down
+        self.retry_policy = RetryPolicy.from_config()
+        self.circuit_breaker = CircuitBreaker.from_config()
+        # queue the calls to stay below the rate the API can sustain
+        self.rate_limiter = RateLimiter.from_config()
+
+        # send the filters of get_data along with the request, switched off
+        # automatically if the API does not support it
+        self.pushdown = uconfig.getboolean('RunDB', 'api_pushdown', fallback=True)
+
     # Helper:
+    def _get(self, url, stream=False, headers=None):
+        if stream or self.cache is None or self.cache.ttl(url) is None:
+            return self._get_uncached(url, stream=stream, headers=headers)
+        response = self.cache.get(url)
+        if response is None:
+            response = self._get_uncached(url)
+            self.cache.put(url, response, len(response.content))
+        return response
+
     @Responder
-    def _get(self, url):
-        return requests.get(PREFIX + url, headers=self.headers)
+    def _get_uncached(self, url, stream=False, headers=None):
+        if headers:
+            headers = {**self.headers, **headers}
+        else:
+            headers = self.headers
+        return self.session.get(PREFIX + url, headers=headers, stream=stream)
 
     @Responder
     def _put(self, url, data):
-        return requests.put(PREFIX + url, data=data, headers=self.headers)
+        return self.session.put(PREFIX + url, data=data, headers=self.headers)
 
     @Responder
     def _post(self, url, data):
-        return requests.post(PREFIX + url, data=data, headers=self.headers)
+        return self.session.post(PREFIX + url, data=data, headers=self.headers)
 
     @Responder
     def _delete(self, url, data):
-        return requests.delete(PREFIX + url, data=data, headers=self.headers)
+        return self.session.delete(PREFIX + url, data=data, headers=self.headers)
+
+    def close(self):
+        """Close all the pooled connections of this DB"""
+        self.session.close()
+
+    def _invalidate_run(self, identifier):
+        """Remove all the cached responses of a run after it was modified"""
+        identifier = str(identifier)
+        if self.doc_cache is not None:
+            doc = self.doc_cache.get(identifier) or {}
+            for key in {identifier, str(doc.get('name')), str(doc.get('number'))}:
+                self.doc_cache.invalidate(key)
+        if self.cache is None:
+            return
+        removed = (self.cache.invalidate(f'/runs/number/{identifier}')
+                   + self.cache.invalidate(f'/runs/name/{identifier}'))
+        # The same run may also be cached under its other identifier
+        for response in removed:
+            try:
+                results = json_backend.loads(response.content).get('results')
+            except ValueError:
+                continue
+            if not isinstance(results, dict):
+                continue
+            if 'number' in results:
+                self.cache.invalidate(f"/runs/number/{results['number']}")
+            if 'name' in results:
+                self.cache.invalidate(f"/runs/name/{results['name']}")
+
+    def _invalidate_context(self, context, straxen_version):
+        if self.cache is not None:
+            self.cache.invalidate(f'/contexts/{straxen_version}/{context}')
 
-    def _is_run_number(self, identifier):
+    @staticmethod
+    def _is_run_number(identifier):
         '''
         Takes a string and classifies it as a run number (as opposed to a
         run name)
@@ -221,7 +457,7 @@ class DB():
 
     def _get_from_results(self, name_or_number, key):
         url = "/runs/number/{name_or_number}/filter/detector".format(name_or_number=name_or_number)
-        response = json.loads(self._get(url).text)
+        response = json_backend.loads(self._get(url).content)
         if (response is None
                 or 'results' not in response
                 or key not in response['results']):
@@ -258,15 +494,26 @@ class DB():
         url = '/runs/name/{num}'.format(num=identifier)
         if self._is_run_number(identifier):
             url = '/runs/number/{num}'.format(num=identifier)
-        # TODO what should be default
-        return json.loads(self._get(url).text).get('results', None)
 
-    def get_data(self, identifier, **filters):
+        def fetch():
+            # TODO what should be default
+            return json_backend.loads(self._get(url).content).get('results', None)
+
+        if self.doc_cache is not None:
+            return self.doc_cache.get_or_fetch(identifier, fetch)
+        return fetch()
+
+    def get_data(self, identifier, projection=None, **filters):
         '''
         Retrieves the data portion of a document from the
         database. The identifier could be a run number of
         run name - the disambiguation takes place
         automatically.
+
+        The filters (key=value pairs the data entries must match) and the
+        projection (the fields of the data entries to return) are sent
+        along with the request so the API can reduce the payload. They are
+        applied again locally in case the API ignores them.
         '''
 
         # map from all kinds of types (int, np int, ...)
@@ -276,22 +523,78 @@ class DB():
         if self._is_run_number(identifier):
             url = '/runs/number/{num}/data'.format(num=identifier)
 
-        data = json.loads(self._get(url).text).get('results', {})
+        query_string = data_query_string(filters, projection) if self.pushdown else ''
+        try:
+            response = self._get(url + query_string)
+        except APIError as e:
+            # a bad request means the API does not understand the filters
+            if not query_string or e.status_code != 400:
+                raise
+            logger.warning('The API does not support filters on the data, '
+                           'filtering locally from now on')
+            self.pushdown = False
+            response = self._get(url)
+
+        data = json_backend.loads(response.content).get('results', {})
         if 'data' not in data:
             raise RuntimeError('The requested document does not have a data key/value')
 
-        data = data['data']
+        return filter_data(data['data'], filters, projection)
 
-        ret = []
-        for d in data:
-            passes_filter = True
-            for key, val in filters.items():
-                if d.get(key) != val:
-                    passes_filter = False
-            if passes_filter:
-                ret.append(d)
+    def _map_concurrent(self, func, identifiers, max_workers=None, **kwargs):
+        '''
+        Call func(identifier, **kwargs) for all identifiers using a bounded
+        pool of threads. Results are returned in the order of the
+        identifiers. A failing call does not stop the others, instead the
+        exception is stored per identifier.
 
-        return ret
+        :return: tuple of (list of results, with None for failed calls,
+            dict of identifier -> exception for the failed calls)
+        '''
+        # this also takes the numpy arrays from io.load_runlist
+        identifiers = list(identifiers)
+        if max_workers is None:
+            max_workers = uconfig.getint('RunDB', 'api_max_workers', fallback=8)
+
+        results = [None] * len(identifiers)
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(func, identifier, **kwargs): i
+                       for i, identifier in enumerate(identifiers)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except (APIError, RuntimeError, ValueError, requests.RequestException) as e:
+                    logger.warning(f'{func.__name__} failed for {identifiers[i]}: {e}')
+                    errors[identifiers[i]] = e
+        return results, errors
+
+    def get_docs(self, identifiers, max_workers=None):
+        '''
+        Retrieves the documents of many runs concurrently. The identifiers
+        can be any iterable of run numbers or run names (e.g. the output of
+        io.load_runlist).
+
+        :param identifiers: iterable of run numbers or names
+        :param max_workers: int, number of concurrent requests. Taken from
+            the [RunDB] api_max_workers config field if not specified.
+            Should not exceed the pool size of the session.
+        :return: tuple of (list of documents in the order of identifiers,
+            dict of identifier -> exception for the runs that failed)
+        '''
+        return self._map_concurrent(self.get_doc, identifiers, max_workers=max_workers)
+
+    def get_data_many(self, identifiers, max_workers=None, **filters):
+        '''
+        Retrieves the data portion of many runs concurrently, see get_docs
+        and get_data.
+
+        :return: tuple of (list of data lists in the order of identifiers,
+            dict of identifier -> exception for the runs that failed)
+        '''
+        return self._map_concurrent(self.get_data, identifiers,
+                                    max_workers=max_workers, **filters)
 
     def update_data(self, identifier, datum):
         '''
@@ -309,7 +612,9 @@ class DB():
         if self._is_run_number(identifier):
             url = '/run/number/{num}/data/'.format(num=identifier)
 
-        return self._post(url, data=datum)
+        response = self._post(url, data=datum)
+        self._invalidate_run(identifier)
+        return response
 
     def delete_data(self, identifier, datum):
         '''
@@ -326,30 +631,69 @@ class DB():
         if self._is_run_number(identifier):
             url = '/run/number/{num}/data/'.format(num=identifier)
 
-        return self._delete(url, data=datum)
+        response = self._delete(url, data=datum)
+        self._invalidate_run(identifier)
+        return response
 
     def query(self, page_num):
         url = '/runs/page/{page_num}'.format(page_num=page_num)
-        response = json.loads(self._get(url).text)
+        response = json_backend.loads(self._get(url).content)
         return response.get('results', {})
 
     def query_by_source(self, source, page_num):
         url = '/runs/source/{source}/page/{page_num}'.format(source=source, page_num=page_num)
-        response = json.loads(self._get(url).text)
+        response = json_backend.loads(self._get(url).content)
         return response.get('results', {})
 
     def query_by_tag(self, tag, page_num):
         url = '/runs/tag/{tag}/page/{page_num}'.format(tag=tag, page_num=page_num)
-        response = json.loads(self._get(url).text)
+        response = json_backend.loads(self._get(url).content)
         return response.get('results', {})
 
+    def _page_query(self, source=None, tag=None):
+        """Get the function that queries one page of runs"""
+        if source is not None and tag is not None:
+            raise ValueError('Can only query by source or by tag, not both')
+        if source is not None:
+            return functools.partial(self.query_by_source, source)
+        if tag is not None:
+            return functools.partial(self.query_by_tag, tag)
+        return self.query
+
+    def iter_runs(self, source=None, tag=None, first_page=1, prefetch=True):
+        '''
+        Iterate over all the run documents, optionally only of one source
+        or tag. The documents are yielded page by page, while the next page
+        is already fetched in the background. Stops at the first empty page.
+
+        :param source: str, only yield runs of this source (see query_by_source)
+        :param tag: str, only yield runs with this tag (see query_by_tag)
+        :param first_page: int, page to start from
+        :param prefetch: bool, fetch the next page while the current one
+            is being consumed
+        '''
+        fetch = self._page_query(source=source, tag=tag)
+        page_num = first_page
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            next_page = executor.submit(fetch, page_num=page_num)
+            while True:
+                page = next_page.result()
+                if not page:
+                    return
+                page_num += 1
+                if prefetch:
+                    next_page = executor.submit(fetch, page_num=page_num)
+                yield from page
+                if not prefetch:
+                    next_page = executor.submit(fetch, page_num=page_num)
+
     def get_hash(self, context, datatype, straxen_version):
         if '.' in straxen_version:
             straxen_version = straxen_version.replace('.', '_')
         url = '/contexts/{straxen_version}/{context}/{dtype}'.format(context=context,
                                                                      dtype=datatype,
                                                                      straxen_version=straxen_version)
-        response = json.loads(self._get(url).text)
+        response = json_backend.loads(self._get(url).content)
         return response.get('results', {})
 
     def update_context_collection(self, data):
@@ -359,36 +703,34 @@ class DB():
         url = '/contexts/{straxen_version}/{context}/'.format(context=context,
                                                               straxen_version=straxen_version)
         data['date_added'] = data['date_added'].isoformat()
-        response = json.loads(self._post(url, data=json.dumps(data)).text)
+        response = json_backend.loads(self._post(url, data=json.dumps(data)).content)
+        self._invalidate_context(context, straxen_version)
         return response.get('results', {})
 
     def delete_context_collection(self, context, straxen_version):
         straxen_version = straxen_version.replace('.', '_')
         url = '/contexts/{straxen_version}/{context}/'.format(context=context,
                                                               straxen_version=straxen_version)
-        response = json.loads(self._delete(url, data=None).text)
+        response = json_backend.loads(self._delete(url, data=None).content)
+        self._invalidate_context(context, straxen_version)
         return response.get('results', {})
 
     def get_context(self, context, straxen_version):
         straxen_version = straxen_version.replace('.', '_')
         url = '/contexts/{straxen_version}/{context}/'.format(context=context,
                                                               straxen_version=straxen_version)
-        response = json.loads(self._get(url).text)
+        response = json_backend.loads(self._get(url).content)
         return response.get('results', {})
 
     def get_rses(self, run_number, dtype, hash):
-        data = self.get_data(run_number)
-        rses = []
-        for d in data:
-            assert 'host' in d and 'type' in d, (
-                f"invalid data-doc retrieved for {run_number} {dtype} {hash}")
-            # Did is only in rucio-cataloge, hence don't ask for it to
-            # be in all docs in data
-            if (d['host'] == "rucio-catalogue" and d['type'] == dtype and
-                    hash in d['did'] and d['status'] == 'transferred'):
-                rses.append(d['location'])
-
-        return rses
+        data = self.get_data(run_number,
+                             projection=('did', 'location'),
+                             host='rucio-catalogue',
+                             type=dtype,
+                             status='transferred')
+        # Did is only in rucio-cataloge, the hash can't be pushed down as
+        # it's only a part of the did
+        return [d['location'] for d in data if hash in d['did']]
 
     # TODO
     def get_all_contexts(self):
@@ -423,35 +765,160 @@ class DB():
         url = '/mc/documents/'
         return self._delete(url, data=doc)
 
-    def download_file(self, filename, save_dir='./', force=False):
+    def download_file(self, filename, save_dir='./', force=False, chunk_size=None):
         """Downloads file from GridFS"""
-        url = f'/files/{filename}'
         os.makedirs(save_dir, exist_ok=True)
         write_to = os.path.join(save_dir, filename)
         if os.path.exists(write_to) and not force:
             logger.debug(f"{filename} already exists at {write_to} and the 'force' flag is not set.")
-        else:
-            logger.debug(f"Downloading {filename} from gridfs...")
-            response = self._get(url)
-            with open(write_to, 'wb') as f:
-                f.write(response.content)
-            logger.debug(f'DONE. {filename} downloaded to {write_to}')
+            return write_to
+        # Only one process downloads the file, the others wait for it
+        with target_lock(write_to):
+            if os.path.exists(write_to) and not force:
+                logger.debug(f"{filename} was downloaded to {write_to} by another process.")
+            else:
+                logger.debug(f"Downloading {filename} from gridfs...")
+                self.stream_file(filename, write_to, chunk_size=chunk_size)
+                logger.debug(f'DONE. {filename} downloaded to {write_to}')
         return write_to
 
-    def load_file(self, filename, save_dir=None, force=False):
+    def stream_file(self, filename, write_to, chunk_size=None, md5=None, verify=True):
+        """
+        Stream a file from GridFS to disk, holding at most chunk_size bytes
+        in memory. The file is written to write_to + '.<md5>.part' (or
+        write_to + '.part' without verification), which is renamed to
+        write_to once complete and verified, so write_to is never seen
+        half-written.
+
+        If the download is interrupted the partial file is kept, and the
+        next call only requests the missing bytes (HTTP Range request).
+        Naming it after the md5 makes sure we never resume with the bytes
+        of another version of the file. Should a resumed download still
+        not match the md5, it is downloaded once more from the start.
+
+        :param filename: str, name of the file in GridFS
+        :param write_to: str, path to store the file at
+        :param chunk_size: int, bytes per chunk. Taken from the [RunDB]
+            download_chunk_size config field if not specified (1 MiB).
+        :param md5: str, expected md5 of the file. If not given (and
+            verify is set) it is taken from get_file_md5.
+        :param verify: bool, check the md5 of the downloaded file. On a
+            mismatch the partial file is removed and a RuntimeError raised.
+        :return: str, md5 of the downloaded file
+        """
+        if chunk_size is None:
+            chunk_size = uconfig.getint('RunDB', 'download_chunk_size', fallback=1024 ** 2)
+        if md5 is None and verify:
+            md5 = self.get_file_md5(filename)
+        url = f'/files/{filename}'
+        part_path = write_to + '.part' if md5 is None else f'{write_to}.{md5}.part'
+        resumed = os.path.exists(part_path)
+
+        attempt = 0
+        while True:
+            try:
+                hash_md5 = self._download_part(url, part_path, chunk_size)
+                break
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                # the connection dropped halfway, resume from what we have
+                if attempt >= self.retry_policy.max_retries:
+                    raise
+                attempt += 1
+                logger.info(f'Download of {filename} interrupted ({e}), resuming')
+
+        if md5 is not None and hash_md5.hexdigest() != md5:
+            os.remove(part_path)
+            if resumed:
+                logger.info(f'Resumed download of {filename} is corrupt, starting over')
+                return self.stream_file(filename, write_to, chunk_size=chunk_size, md5=md5)
+            raise RuntimeError(f'Downloaded {filename} has md5 {hash_md5.hexdigest()}, '
+                               f'expected {md5}')
+        os.replace(part_path, write_to)
+        return hash_md5.hexdigest()
+
+    def _download_part(self, url, part_path, chunk_size):
+        """
+        Append the bytes of url that are not yet in part_path to it
+
+        :return: hashlib.md5 object of the complete part_path
+        """
+        hash_md5 = hashlib.md5()
+        offset = 0
+        if os.path.exists(part_path):
+            # continue where we left off, the md5 needs the part we have
+            with open(part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    hash_md5.update(chunk)
+                offset = f.tell()
+
+        try:
+            response = self._get(url, stream=True,
+                                 headers={'Range': f'bytes={offset}-'} if offset else None)
+        except APIError as e:
+            if e.status_code != 416:
+                raise
+            # Range not satisfiable, our partial file is no good
+            os.remove(part_path)
+            return self._download_part(url, part_path, chunk_size)
+
+        with response, open(part_path, 'ab' if offset else 'wb') as f:
+            if offset and response.status_code != 206:
+                logger.debug(f'Cannot resume {url}, downloading it from the start')
+                hash_md5 = hashlib.md5()
+                f.truncate(0)
+            elif offset:
+                logger.debug(f'Resuming {url} from byte {offset}')
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                hash_md5.update(chunk)
+        return hash_md5
+
+    def load_file(self, filename, save_dir=None, force=False, cached=False, **kwargs):
+        """
+        Download a file from GridFS (if we do not have it yet) and open it
+        with utilix.io.read_file
+
+        :param cached: bool, reuse the result of an earlier call for the
+            same (unchanged) file, see utilix.io.read_file_cached. The
+            numpy arrays in the result are then read only and shared with
+            the other callers.
+        :param kwargs: passed on to read_file
+        """
         if save_dir is None:
             save_dir = os.path.join(os.environ.get("HOME"), '.gridfs_cache')
         path = self.download_file(filename, save_dir=save_dir, force=force)
-        return io.read_file(path)
-
-    def upload_file(self, filepath, filename=None):
-        with open(filepath, 'rb') as f:
-            fb = f.read()
+        if cached:
+            return io.read_file_cached(path, **kwargs)
+        return io.read_file(path, **kwargs)
+
+    def upload_file(self, filepath, filename=None, chunk_size=None, callback=None,
+                    return_md5=False):
+        """
+        Upload a file to GridFS. The file is streamed in chunks, so memory
+        use does not depend on the file size.
+
+        :param filepath: str, path of the file to upload
+        :param filename: str, name to store the file under, defaults to
+            the basename of filepath
+        :param chunk_size: int, bytes per chunk. Taken from the [RunDB]
+            upload_chunk_size config field if not specified (1 MiB).
+        :param callback: callable, called as callback(bytes_sent, total_bytes)
+            after every chunk to report the progress
+        :param return_md5: bool, also return the md5 of the uploaded
+            file, computed while uploading
+        :return: the response, or (response, md5) if return_md5
+        """
+        if chunk_size is None:
+            chunk_size = uconfig.getint('RunDB', 'upload_chunk_size', fallback=1024 ** 2)
         # if no specific filename passed, just get it from the path
         if not filename:
             filename = os.path.basename(filepath)
         url = f'/files/{filename}'
-        return self._post(url, data=fb)
+        stream = UploadStream(filepath, chunk_size=chunk_size, callback=callback)
+        response = self._post(url, data=stream)
+        if return_md5:
+            return response, stream.md5
+        return response
 
     def get_files(self, query: dict, projection=None):
         """Do a general query on the fs.files collection"""
@@ -461,13 +928,14 @@ class DB():
             projection = {}
         data = json.dumps(dict(query=query, projection=projection))
         result = self._post(url, data=data)
-        response = result.json()
+        response = json_backend.loads(result.content)
         return response.get('results', [])
 
     def count_files(self, query: dict)->int:
         """Perform colection.count_documents on the fs.files-collection using the query"""
         """<URL MAGIC>"""
-        docs = self.get_files(query)
+        # we only need the number of documents, not their content
+        docs = self.get_files(query, projection={'_id': 1})
         return len(docs)
 
     def delete_file(self, filename):
@@ -481,11 +949,45 @@ class DB():
 
     def get_file_md5(self, filename):
         url = f"/files/{filename}/md5"
-        response = self._get(url).json()
+        response = json_backend.loads(self._get(url).content)
         return response['results']
 
 
 
+class UploadStream:
+    """
+    Iterable over the chunks of a file, to be used as the body of a
+    request. The md5 of the file is computed while it is being sent.
+    """
+
+    def __init__(self, path, chunk_size=1024 ** 2, callback=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.callback = callback
+        self.size = os.path.getsize(path)
+        self._md5 = hashlib.md5()
+
+    def __len__(self):
+        # lets requests send a Content-Length instead of a chunked body
+        return self.size
+
+    def __iter__(self):
+        self._md5 = hashlib.md5()
+        sent = 0
+        with open(self.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                self._md5.update(chunk)
+                sent += len(chunk)
+                if self.callback is not None:
+                    self.callback(sent, self.size)
+                yield chunk
+
+    @property
+    def md5(self):
+        """md5 of the chunks sent so far (i.e. of the file once sent)"""
+        return self._md5.hexdigest()
+
+
 class PyMongoCannotConnect(Exception):
     """Raise error when we cannot connect to the pymongo client"""
     pass